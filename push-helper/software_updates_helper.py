@@ -4,38 +4,553 @@
 # Software Updates Push Notifications helper.
 #
 # This helper is called with one of three things:
-# a) regular push messages about updated click packages¹
+# a) regular push messages about updated click packages
 # b) broadcast messages about system updates
 # c) notifications you send yourself over dbus to actually notify the user that
-#    an update is ready to install².
+#    an update is ready to install¹.
 #
 # Figuring out which of those is the case is also this helper's job.
 #
+# Starting a fresh interpreter for every message eats into the few seconds
+# the push client gives us, so the helper can also run as a long-lived
+# daemon (``--daemon``, usually socket-activated). When it's around, the
+# script the push client runs (software_updates_shim.py) just forwards its
+# two file names (and its locale) to it and exits; when it isn't, the shim
+# imports this module and the message is handled in-process as before. The
+# daemon also checks for updates itself, one check at a time, instead of
+# forking for every broadcast.
+#
 # notes:
-# 1. nobody is sending those at the time of writing.
-# 2. yes, this is rather convoluted. Most push helpers don't have to deal with
+# 1. yes, this is rather convoluted. Most push helpers don't have to deal with
 #    this stuff.
 
 import os
+import collections
+import fcntl
 import json
+import re
+import socket
 import sys
+import threading
 import time
-import gettext
 import logging
-import logging.handlers
-from xdg.BaseDirectory import save_cache_path
 
-_ = gettext.translation('ubuntu-system-settings', fallback=True).gettext
+# Everything else is imported where it's needed: a message handed to the
+# daemon, or one that only needs the answer written out, shouldn't pay for
+# translations, xdg, D-Bus or logging to a file.
+
+# the variables gettext picks the language from, in order; the shim sends
+# these along
+LOCALE_VARS = ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")
+
+# those of the push client whose message is being handled, if they're not
+# ours; the daemon's are the user session manager's
+_locale_environ = None
+_translations = {}
+
+
+def current_locale():
+    """The locale gettext translates into."""
+    environ = os.environ if _locale_environ is None else _locale_environ
+    for var in LOCALE_VARS:
+        value = environ.get(var)
+        if value:
+            return value
+    return "C"
+
+
+def translation():
+    locale = current_locale()
+    if locale not in _translations:
+        import gettext
+        _translations[locale] = gettext.translation(
+            'ubuntu-system-settings', languages=locale.split(":"),
+            fallback=True)
+    return _translations[locale]
+
+
+def _(message):
+    return translation().gettext(message)
+
+
+def ngettext(singular, plural, n):
+    return translation().ngettext(singular, plural, n)
+
 
 SYS_UPDATE = "system-image-update"
+CLICK_UPDATES = "click-updates"
+APP_ID = "_ubuntu-system-settings"
+
+# how long the shim waits for the daemon before handling things itself (as
+# in the shim)
+FORWARD_TIMEOUT = 2.0
+# how long the daemon hangs around without any messages before exiting
+DAEMON_IDLE_TIMEOUT = 300
+# first file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+# how many channel/device keys the broadcast cache remembers
+BROADCAST_CACHE_SIZE = 32
+# how long (in seconds) a cached build keeps suppressing broadcasts
+BROADCAST_CACHE_TTL = 7 * 24 * 60 * 60
+# how long (in seconds) a whole update check may take, downloading included
+CHECK_DEADLINE = 30 * 60
+# how long (in seconds) to wait for each signal once we start expecting it
+SIGNAL_TIMEOUTS = {
+    "UpdateAvailableStatus": 60,
+    "UpdateDownloaded": 20 * 60,
+}
+# for how long (in seconds) after posting a notification we don't post
+# another one
+NOTIFY_COALESCE_WINDOW = 60
+# click's per-user registrations; installing or removing a click package
+# touches one of these
+CLICK_USER_DBS = (
+    "/opt/click.ubuntu.com/.click/users/" + os.environ.get("USER", ""),
+    "/opt/click.ubuntu.com/.click/users/@all",
+    "/usr/share/click/preinstalled/.click/users/@all",
+)
+# how many log records we keep in memory before dropping the oldest
+LOG_RING_SIZE = 1024
+# how often (in seconds) buffered log records are written out
+LOG_FLUSH_INTERVAL = 1.0
+UPDATE_ICON = ("/usr/share/ubuntu/settings/system/icons/"
+               "settings-system-update.svg")
+
+CLICK_PAYLOAD_RE = re.compile(r'\s*\{\s*"%s"\s*:\s*\[' % CLICK_UPDATES)
+
+
+def cache_dir():
+    from xdg.BaseDirectory import save_cache_path
+
+    return save_cache_path("ubuntu-system-settings")
+
+
+class BroadcastCache:
+    """Remembers the highest build seen per channel/device key.
+
+    The broadcast payload looks like {"channel/device": [build, alias]}; if
+    we've already handled that build (or a newer one) for every key in it,
+    there's no point in checking for updates again.
+
+    The cache is a small json file, replaced atomically and guarded by a lock
+    file so concurrent helpers don't lose each other's updates. It holds at
+    most max_entries keys, and entries older than ttl seconds are forgotten.
+    """
+
+    def __init__(self, path, max_entries=BROADCAST_CACHE_SIZE,
+                 ttl=BROADCAST_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @staticmethod
+    def builds(payload):
+        """Return {key: build} for a broadcast payload, or None if it doesn't
+        look like one."""
+        if not isinstance(payload, dict) or not payload:
+            return None
+        builds = {}
+        for key, value in payload.items():
+            if (not isinstance(value, list) or not value or
+                    not isinstance(value[0], int)):
+                return None
+            builds[key] = value[0]
+        return builds
+
+    def load(self, now=None):
+        """Return the unexpired entries as {key: [build, seen]}."""
+        now = time.time() if now is None else now
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return {key: entry for key, entry in entries.items()
+                if self.valid(entry) and now - entry[1] < self.ttl}
+
+    @staticmethod
+    def valid(entry):
+        """Whether entry looks like [build, seen], as we write them."""
+        return (isinstance(entry, list) and len(entry) == 2 and
+                type(entry[0]) is int and
+                type(entry[1]) in (int, float))
+
+    def save(self, entries):
+        if len(entries) > self.max_entries:
+            newest = sorted(entries, key=lambda k: entries[k][1],
+                            reverse=True)[:self.max_entries]
+            entries = {key: entries[key] for key in newest}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def record(self, payload, now=None):
+        """Record the builds named in payload.
+
+        Returns True if the broadcast is news to us and should be acted upon,
+        False if it is a repeat or stale.
+        """
+        builds = self.builds(payload)
+        if builds is None:
+            # not something we understand; better check than miss an update
+            return True
+        now = time.time() if now is None else now
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.load(now)
+            new = False
+            for key, build in builds.items():
+                if key not in entries or build > entries[key][0]:
+                    new = True
+                    entries[key] = [build, now]
+            if new:
+                self.save(entries)
+        return new
+
+    def forget(self, payload):
+        """Forget the builds named in payload, so that the next broadcast
+        about them is acted upon again."""
+        builds = self.builds(payload)
+        if builds is None:
+            return
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.load()
+            for key, build in builds.items():
+                if key in entries and entries[key][0] == build:
+                    del entries[key]
+            self.save(entries)
+
+
+def iter_click_updates(raw):
+    """Yield the entries of a click-update payload one by one.
+
+    The payload looks like {"click-updates": [{"name": ..., "version": ...},
+    ...]}, with possibly hundreds of entries, so rather than decoding all of
+    it up front each entry is decoded as we get to it.
+    """
+    decoder = json.JSONDecoder()
+    pos = CLICK_PAYLOAD_RE.match(raw).end()
+    whitespace = re.compile(r"[\s,]*")
+    while True:
+        pos = whitespace.match(raw, pos).end()
+        if raw.startswith("]", pos):
+            return
+        entry, pos = decoder.raw_decode(raw, pos)
+        yield entry
+
+
+_apt_pkg = None
+
+
+def version_newer(candidate, installed):
+    global _apt_pkg
+
+    if _apt_pkg is None:
+        try:
+            import apt_pkg
+        except ImportError:
+            apt_pkg = False
+        else:
+            apt_pkg.init_system()
+        _apt_pkg = apt_pkg
+    if not _apt_pkg:
+        # without apt we can't order versions; assume changes are upgrades
+        return candidate != installed
+    return _apt_pkg.version_compare(candidate, installed) > 0
+
+
+class ClickIndex:
+    """The versions of the installed click packages.
+
+    Asking click is slow, so the index is kept in a json file at path and
+    only rebuilt from ``click list --manifest`` when one of the click user
+    databases has changed since.
+    """
+
+    def __init__(self, path, databases=CLICK_USER_DBS):
+        self.path = path
+        self.databases = databases
+
+    def stamp(self):
+        stamp = []
+        for database in self.databases:
+            try:
+                stamp.append(os.stat(database).st_mtime)
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def build(self):
+        """Ask click; returns None if it can't tell us."""
+        import subprocess
+
+        click = os.environ.get("CLICK_COMMAND", "click")
+        try:
+            manifests = json.loads(subprocess.check_output(
+                [click, "list", "--manifest"]).decode("utf-8"))
+            return {m["name"]: m["version"] for m in manifests}
+        except (OSError, subprocess.CalledProcessError, ValueError, KeyError,
+                TypeError):
+            logging.exception("Could not list installed click packages:")
+            return None
+
+    def load(self):
+        """Return the (stamp, versions) last written to path, or None."""
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            return index["stamp"], index["versions"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def rebuild(self, stamp):
+        """Ask click, and write what it said to path as of stamp. Returns
+        the versions, or None if click can't tell us."""
+        logging.debug("Rebuilding click index.")
+        versions = self.build()
+        if versions is not None:
+            write_output(self.path,
+                         json.dumps({"stamp": stamp, "versions": versions}))
+        return versions
+
+    def versions(self):
+        """Return {package name: installed version}."""
+        stamp = self.stamp()
+        index = self.load()
+        if index is not None and index[0] == stamp:
+            return index[1]
+        versions = self.rebuild(stamp)
+        if versions is None:
+            # nothing is installed as far as we know; try again next time
+            return {}
+        return versions
+
+    def updates(self, entries):
+        """Return the names of the packages in entries that are installed
+        in an older version."""
+        versions = self.versions()
+        names = []
+        for entry in entries:
+            try:
+                name, version = entry["name"], entry["version"]
+            except (KeyError, TypeError):
+                continue
+            if name in versions and version_newer(version, versions[name]):
+                names.append(name)
+        return names
+
+
+class NotReady(Exception):
+    """The daemon can't answer yet; the shim should handle the message."""
+
+
+class BackgroundClickIndex(ClickIndex):
+    """The daemon's click index, rebuilt in a thread of its own.
+
+    Asking click can take longer than the shim waits for the daemon, so
+    messages are answered from the versions indexed last while a rebuild
+    runs. Until there are any, versions() raises NotReady.
+    """
+
+    def __init__(self, path, databases=CLICK_USER_DBS):
+        super().__init__(path, databases)
+        self.lock = threading.Lock()
+        # the (stamp, versions) indexed last
+        self.known = None
+        self.thread = None
+
+    def refresh(self):
+        """Start a rebuild, unless the index is current or one is running."""
+        stamp = self.stamp()
+        with self.lock:
+            if self.known is not None and self.known[0] == stamp:
+                return
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.refresh_thread,
+                                           args=(stamp,), daemon=True)
+            self.thread.start()
+
+    def refresh_thread(self, stamp):
+        index = self.load()
+        if index is None or index[0] != stamp:
+            versions = self.rebuild(stamp)
+            if versions is None:
+                # the next message tries again
+                return
+            index = stamp, versions
+        with self.lock:
+            self.known = index
+
+    def versions(self):
+        self.refresh()
+        with self.lock:
+            known = self.known
+        if known is None:
+            # whatever is on file, however old, beats waiting for click
+            known = self.load()
+        if known is None:
+            raise NotReady("Click index not built yet")
+        return known[1]
+
+
+def click_notification(names):
+    return {
+        "notification": {
+            "tag": CLICK_UPDATES,
+            "emblem-counter": {
+                "count": len(names),
+                "visible": True,
+            },
+            "card": {
+                "summary": ngettext("%d app can be updated.",
+                                    "%d apps can be updated.",
+                                    len(names)) % len(names),
+                "body": _("Tap to open the system updater."),
+                "actions": ["settings:///system/system-update"],
+                "icon": UPDATE_ICON,
+                "timestamp": int(time.time()),
+                "persist": True,
+            },
+        },
+    }
+
+
+def system_update_notification(timestamp, icon=UPDATE_ICON):
+    return {
+        "notification": {
+            "tag": SYS_UPDATE,
+            "emblem-counter": {
+                "count": 1,
+                "visible": True,
+            },
+            "vibrate": {
+                "pattern": [50, 150],
+                "repeat": 3,
+            },
+            "card": {
+                "summary": _("There's an updated system image."),
+                "body": _("Tap to open the system updater."),
+                "actions": ["settings:///system/system-update"],
+                "icon": icon,
+                "timestamp": timestamp,
+                "persist": True,
+            },
+        },
+    }
+
+
+class CardTemplates:
+    """Pre-rendered system update notifications, by locale and icon.
+
+    Only the timestamp changes from one notification to the next, so the
+    rest is translated and serialized once, kept in memory and in a file in
+    directory, and the timestamp spliced in when it's needed. The files are
+    rebuilt when the translations or this script change.
+    """
+
+    PLACEHOLDER = "@TIMESTAMP@"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.templates = {}
+
+    def stamp(self, locale):
+        """What the template for locale is rendered from: the catalog it's
+        translated with, and this script."""
+        import gettext
+
+        catalog = gettext.find("ubuntu-system-settings",
+                               languages=locale.split(":"))
+        stamp = []
+        for path in (catalog, __file__):
+            try:
+                stamp.append(os.stat(path).st_mtime)
+            except (OSError, TypeError):
+                stamp.append(None)
+        return stamp
+
+    def path(self, locale, icon):
+        import hashlib
+
+        key = json.dumps([locale, icon]).encode("utf-8")
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + ".json")
+
+    def load(self, locale, icon):
+        """Return the template for locale and icon as (prefix, suffix)."""
+        path = self.path(locale, icon)
+        stamp = self.stamp(locale)
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached["stamp"] == stamp:
+                return cached["prefix"], cached["suffix"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        logging.debug("Rendering notification for %s.", locale)
+        rendered = json.dumps(system_update_notification(self.PLACEHOLDER,
+                                                         icon))
+        prefix, suffix = rendered.split(json.dumps(self.PLACEHOLDER))
+        os.makedirs(self.directory, exist_ok=True)
+        write_output(path, json.dumps(
+            {"stamp": stamp, "prefix": prefix, "suffix": suffix}))
+        return prefix, suffix
+
+    def render(self, locale, icon, timestamp):
+        key = (locale, icon)
+        if key not in self.templates:
+            self.templates[key] = self.load(locale, icon)
+        prefix, suffix = self.templates[key]
+        return prefix + str(int(timestamp)) + suffix
+
+
+_card_templates = None
+
+
+def card_templates():
+    global _card_templates
+
+    if _card_templates is None:
+        _card_templates = CardTemplates(os.path.join(cache_dir(), "cards"))
+    return _card_templates
 
 
 class SystemImage:
-    def __init__(self):
+    """Asks system-image to check for an update and notifies the user if
+    there is one.
+
+    The check gives up after deadline seconds, or when a signal we expect
+    doesn't arrive within its entry in timeouts; outcome says how it ended.
+
+    Used once, run() does the whole check on its own main loop. The daemon
+    instead keeps one around, calls check() for each check, and gets called
+    back with on_done when a check is over; signals arriving in between are
+    ignored.
+    """
+
+    def __init__(self, deadline=CHECK_DEADLINE, timeouts=None, on_done=None):
         self.loop = None
+        self.glib = None
         self.sysimg = None
         self.postal = None
         self.notify = False
+        self.outcome = None
+        self.deadline = deadline
+        self.timeouts = dict(SIGNAL_TIMEOUTS, **(timeouts or {}))
+        self.deadline_id = None
+        self.signal_id = None
+        self.started = None
+        # marks the last time we posted; None means no coalescing
+        self.marker = None
+        self.on_done = on_done
+        self.active = True
 
     def setup(self):
         import dbus
@@ -46,57 +561,278 @@ class SystemImage:
         sys_bus = dbus.SystemBus(mainloop=gloop)
         ses_bus = dbus.SessionBus(mainloop=gloop)
         self.loop = GLib.MainLoop()
+        self.glib = GLib
         self.sysimg = dbus.Interface(
-            sys_bus.get_object("com.canonical.SystemImage", "/Service"),
+            # the daemon outlives system-image and Postal restarts
+            sys_bus.get_object("com.canonical.SystemImage", "/Service",
+                               follow_name_owner_changes=True),
             dbus_interface="com.canonical.SystemImage")
         self.postal = dbus.Interface(
-            ses_bus.get_object("com.ubuntu.Postal", "/com/ubuntu/Postal/_"),
+            ses_bus.get_object("com.ubuntu.Postal", "/com/ubuntu/Postal/_",
+                               follow_name_owner_changes=True),
             dbus_interface="com.ubuntu.Postal")
+        self.marker = os.path.join(cache_dir(), "notification.posted")
+        self.notify = False
+
+    def expect(self, signal):
+        """(Re)start the timeout for the next signal we're waiting for."""
+        if self.signal_id is not None:
+            self.glib.source_remove(self.signal_id)
+        self.signal_id = self.glib.timeout_add_seconds(
+            self.timeouts[signal], self.timeout_cb, signal)
+
+    def timeout_cb(self, what):
+        logging.debug("Timed out waiting for %s.", what)
+        if what == "deadline":
+            self.deadline_id = None
+        else:
+            self.signal_id = None
+        self.outcome = "timeout"
         self.notify = False
+        self.quit()
+        return False
+
+    def cancel(self):
+        """Stop the check where it is, without notifying or calling back."""
+        for source_id in (self.deadline_id, self.signal_id):
+            if source_id is not None:
+                self.glib.source_remove(source_id)
+        self.deadline_id = self.signal_id = None
+        self.active = False
 
     def quit(self):
+        self.cancel()
         if self.notify:
-            logging.debug("Notifying.")
+            try:
+                self.post()
+            except Exception:
+                # Postal not running, maybe; don't hang on to the buses.
+                logging.exception("Could not post the notification:")
+        if self.on_done is not None:
+            self.on_done(self)
+        else:
+            self.loop.quit()
+
+    def post(self):
+        """Post our notification, collapsing concurrent and repeated posts.
+
+        Only one process posts at a time (the others just give up), nothing
+        is posted within NOTIFY_COALESCE_WINDOW of the last post, and nothing
+        is posted while our notification is still outstanding.
+        """
+        if self.marker is None:
+            self.clear_and_post()
+            return
+        with open(self.marker + ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.debug("Someone else is notifying.")
+                return
+            try:
+                posted = os.stat(self.marker).st_mtime
+            except FileNotFoundError:
+                posted = 0
+            if time.time() - posted < NOTIFY_COALESCE_WINDOW:
+                logging.debug("Notified recently.")
+                return
+            self.clear_and_post()
+            with open(self.marker, "w"):
+                pass
+
+    def clear_and_post(self):
+        try:
+            pending = self.postal.ListPersistent(APP_ID)
+        except Exception:
+            # an older Postal, maybe; do it the long way.
+            logging.debug("Could not list notifications.", exc_info=True)
+            pending = None
+        if pending is not None and SYS_UPDATE in pending:
+            logging.debug("Notification still pending.")
+            return
+        logging.debug("Notifying.")
+        if pending is None:
             # remove any older notifications about this
-            self.postal.ClearPersistent("_ubuntu-system-settings", SYS_UPDATE)
-            # send ours. This will of course come back to this same script.
-            self.postal.Post("_ubuntu-system-settings", json.dumps(SYS_UPDATE))
-        self.loop.quit()
+            self.postal.ClearPersistent(APP_ID, SYS_UPDATE)
+        # send ours. This will of course come back to this same script.
+        self.postal.Post(APP_ID, json.dumps(SYS_UPDATE))
 
     def available_cb(self, available, downloading, *ignored):
+        if not self.active:
+            return
         logging.debug("Available: %s; downloading: %s", available, downloading)
         if available:
             if downloading:
                 # handled in the UpdateDownloaded or UpdateFailed handlers
+                self.expect("UpdateDownloaded")
                 return
             # available and not downloading: auto downloads are turned
             # off; notify the user right now.
             self.notify = True
+            self.outcome = "available"
         else:
             # if not available, we were called spuriously. No notification.
             self.notify = False
+            self.outcome = "no-update"
         self.quit()
 
     def downloaded_cb(self):
+        if not self.active:
+            return
         logging.debug("Downloaded.")
         self.notify = True
+        self.outcome = "downloaded"
         self.quit()
 
     def failed_cb(self, *ignored):
+        if not self.active:
+            return
         # give up
         logging.debug("Failed.")
         self.notify = False
+        self.outcome = "failed"
         self.quit()
 
-    def run(self):
-        logging.debug("Checking for update.")
+    def connect(self):
         self.sysimg.connect_to_signal("UpdateAvailableStatus",
                                       self.available_cb)
         self.sysimg.connect_to_signal("UpdateDownloaded", self.downloaded_cb)
         self.sysimg.connect_to_signal("UpdateFailed", self.failed_cb)
-        self.sysimg.CheckForUpdate()
+
+    def check(self):
+        logging.debug("Checking for update.")
+        self.started = time.time()
+        self.active = True
+        self.notify = False
+        self.outcome = None
+        self.deadline_id = self.glib.timeout_add_seconds(
+            self.deadline, self.timeout_cb, "deadline")
+        self.expect("UpdateAvailableStatus")
+        try:
+            self.sysimg.CheckForUpdate()
+        except Exception:
+            self.cancel()
+            raise
+
+    def run(self):
+        self.connect()
+        self.check()
         self.loop.run()
 
+    def record_outcome(self, path):
+        """Write how the check went to path, for the curious."""
+        with open(path, "w") as f:
+            json.dump({
+                "outcome": self.outcome,
+                "notify": self.notify,
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+            }, f)
+
+
+class UpdateCheckService:
+    """Runs the daemon's update checks, without forking.
+
+    There is only ever one check in flight, on bus connections kept for the
+    daemon's lifetime. Broadcasts arriving while a check is running may be
+    about builds that check started too early to see, so once it's done one
+    more check answers all of them. A check still running past its deadline
+    is given up on when the next broadcast comes in.
+    """
+
+    def __init__(self, broadcasts, deadline=CHECK_DEADLINE):
+        self.broadcasts = broadcasts
+        self.deadline = deadline
+        self.checker = None
+        # when the running check started
+        self.started = None
+        # the payloads of the broadcasts the running check answers
+        self.waiting = []
+        # those of the broadcasts that came in after it started
+        self.pending = []
+
+    @property
+    def busy(self):
+        return bool(self.waiting)
+
+    def overdue(self):
+        return time.time() - self.started > self.deadline
+
+    def request(self, arg):
+        if self.busy and not self.overdue():
+            logging.debug("Check already in flight; checking again after.")
+            self.pending.append(arg)
+            return
+        if self.busy:
+            logging.debug("Check in flight is past its deadline; "
+                          "starting over.")
+            self.abandon()
+        self.waiting.append(arg)
+        self.start()
+
+    def abandon(self):
+        """Give up on the running check, and the checker running it.
+
+        The broadcasts that came in after it started are answered by the
+        next check.
+        """
+        self.checker.cancel()
+        self.checker = None
+        for arg in self.waiting:
+            self.broadcasts.forget(arg)
+        self.waiting, self.pending = self.pending, []
+
+    def shutdown(self):
+        """Stop checking, forgetting the broadcasts we won't get to answer
+        so they aren't suppressed the next time round."""
+        if self.checker is not None:
+            self.checker.cancel()
+            self.checker = None
+        for arg in self.waiting + self.pending:
+            self.broadcasts.forget(arg)
+        self.waiting, self.pending = [], []
+
+    def start(self):
+        try:
+            if self.checker is None:
+                checker = SystemImage(deadline=self.deadline,
+                                      on_done=self.done)
+                checker.setup()
+                checker.connect()
+                self.checker = checker
+            self.started = time.time()
+            self.checker.check()
+        except Exception:
+            # start afresh next time, in case the bus connection is gone
+            self.checker = None
+            for arg in self.waiting:
+                self.broadcasts.forget(arg)
+            self.waiting = []
+            raise
+
+    def done(self, checker):
+        logging.debug("Check finished: %s.", checker.outcome)
+        checker.record_outcome(os.path.join(cache_dir(), "last_check.json"))
+        if checker.outcome in ("failed", "timeout"):
+            # let the next broadcast about these builds try again
+            for arg in self.waiting:
+                self.broadcasts.forget(arg)
+        self.waiting, self.pending = self.pending, []
+        if self.waiting:
+            logging.debug("Checking again for later broadcasts.")
+            try:
+                self.start()
+            except Exception:
+                logging.exception("Could not start the next check:")
+
+
+def broadcast_cache():
+    return BroadcastCache(os.path.join(cache_dir(), "broadcasts.json"))
+
+
+def click_index_path():
+    return os.path.join(cache_dir(), "click-index.json")
+
 
 def main():
     if len(sys.argv) != 3:
@@ -104,7 +840,21 @@ def main():
         sys.exit(1)
 
     f1, f2 = sys.argv[1:3]
+    handle(f1, f2)
+
 
+def handle(f1, f2, service=None, environ=None, click_index=None):
+    """Handle the push message in the file f1, writing our answer to f2.
+
+    Broadcasts are checked by service if given, in a forked child if not.
+    Click updates are looked up in click_index if given, a fresh
+    ClickIndex if not.
+    Notifications are in the language environ, the push client's locale
+    variables, picks; ours if not given.
+    """
+    global _locale_environ
+
+    _locale_environ = environ
     # here you should look at the input (the contents of the file whose
     # name is in f1, which are guaranteed to be json). If it's a broadcast
     # it will be the most recent we've received, and will have passed a
@@ -122,9 +872,11 @@ def main():
     #   {"ubuntu-touch/utopic-proposed/hammerhead":[265,""]}
     #
     #
-    # When the click server starts sending notifications of packages a user
-    # can update, you should probably describe that payload here. What to
-    # do with it is described in some detail in the wiki page above.
+    # The click server tells us about updated click packages with
+    #
+    #   {"click-updates": [{"name": package, "version": version}, ...]}
+    #
+    # of which we only notify about those installed in an older version.
     #
     #
     # Once you've downloaded things and need to actually notify the user,
@@ -137,63 +889,353 @@ def main():
     # empty json object.
 
     with open(f1) as f:
-        arg = json.load(f)
+        raw = f.read()
 
-    obj = {}
+    if CLICK_PAYLOAD_RE.match(raw):
+        # the usual layout, which we can decode as we go
+        handle_click_updates(iter_click_updates(raw), f2, click_index)
+        return
+
+    arg = json.loads(raw)
+    if isinstance(arg, dict) and CLICK_UPDATES in arg:
+        entries = arg[CLICK_UPDATES]
+        handle_click_updates(entries if isinstance(entries, list) else [], f2,
+                             click_index)
+        return
     if arg == "system-image-update":
         logging.debug("system-image-update; requesting regular notification.")
-        icon = "/usr/share/ubuntu/settings/system/icons/" + \
-               "settings-system-update.svg"
-        obj = {
-            "notification": {
-                "tag": SYS_UPDATE,
-                "emblem-counter": {
-                    "count": 1,
-                    "visible": True,
-                },
-                "vibrate": {
-                    "pattern": [50, 150],
-                    "repeat": 3,
-                },
-                "card": {
-                    "summary": _("There's an updated system image."),
-                    "body": _("Tap to open the system updater."),
-                    "actions": ["settings:///system/system-update"],
-                    "icon": icon,
-                    "timestamp": int(time.time()),
-                    "persist": True,
-                },
-            },
-        }
-    elif arg == "testing":
+        write_output(f2, card_templates().render(
+            current_locale(), UPDATE_ICON, int(time.time())))
+        return
+
+    obj = {}
+    if arg == "testing":
         # for tests
         logging.debug("Testing.")
         obj = {"testing": True}
     else:
         # assume it's a broadcast
-        logging.debug("Broadcast; forking.")
-        if os.fork() == 0:
+        broadcasts = broadcast_cache()
+        if not broadcasts.record(arg):
+            # a build we've already handled
+            logging.debug("Repeated or stale broadcast; ignoring.")
+        elif service is not None:
+            logging.debug("Broadcast; handing over to the service.")
+            service.request(arg)
+        else:
+            logging.debug("Broadcast; forking.")
+            check_for_update(arg, broadcasts)
+
+    write_output(f2, json.dumps(obj))
+
+
+def handle_click_updates(entries, f2, index=None):
+    """Notify about the click packages in entries that are installed in an
+    older version, writing our answer to f2."""
+    if index is None:
+        index = ClickIndex(click_index_path())
+    names = index.updates(entries)
+    logging.debug("Click updates for %d installed packages.", len(names))
+    obj = click_notification(names) if names else {}
+    write_output(f2, json.dumps(obj))
+
+
+def write_output(path, data):
+    """Write data to path in one go, atomically, so that the push client
+    never sees half an answer."""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data.encode("utf-8"))
+    os.replace(tmp, path)
+
+
+def check_for_update(arg, broadcasts):
+    """Check for an update in a child process, as we're short-lived."""
+    # or the child would write out the parent's buffered records as well
+    flush_logs()
+    if os.fork() == 0:
+        if _log_ring is not None:
+            _log_ring.after_fork()
+        try:
             os.setsid()
             os.closerange(0, 3)
             logging.debug("Forked.")
             s = SystemImage()
             s.setup()
             s.run()
-            return
+            logging.debug("Check finished: %s.", s.outcome)
+            s.record_outcome(os.path.join(cache_dir(), "last_check.json"))
+            if s.outcome in ("failed", "timeout"):
+                # let the next broadcast about this build try again
+                broadcasts.forget(arg)
+        except Exception:
+            logging.exception("Update check died with exception:")
+            # it never got to check; let the next broadcast try again
+            try:
+                broadcasts.forget(arg)
+            except Exception:
+                logging.exception("Could not forget the broadcast:")
+        finally:
+            # never fall back into the caller, which might be the daemon
+            logging.debug("Done.")
+            flush_logs()
+            os._exit(0)
 
-    json.dump(obj, open(f2, "w"))
 
+def socket_path():
+    """Return the path of the daemon socket (the one the shim forwards to),
+    or None if there's no runtime directory to put it in."""
+    rundir = os.environ.get("XDG_RUNTIME_DIR")
+    if not rundir:
+        return None
+    return os.path.join(rundir, "ubuntu-system-settings", "push-helper.socket")
 
-if __name__ == '__main__':
-    logdir = save_cache_path("ubuntu-system-settings")
+
+def listening_socket(path=None):
+    """Return the socket the daemon should listen on.
+
+    That's the one systemd passed us if we were socket-activated, otherwise a
+    freshly bound one at path.
+    """
+    if (os.environ.get("LISTEN_PID") == str(os.getpid()) and
+            int(os.environ.get("LISTEN_FDS", "0")) >= 1):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM,
+                             fileno=SD_LISTEN_FDS_START)
+    path = path or socket_path()
+    if not path:
+        raise RuntimeError("No XDG_RUNTIME_DIR to put the socket in")
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(16)
+    return sock
+
+
+def parse_request(data):
+    """Split what the shim sent into the two file names and its locale."""
+    fields = [os.fsdecode(field) for field in data.split(b"\0")]
+    if len(fields) < 2:
+        raise ValueError("Expected two file names, got %r" % data)
+    environ = dict(field.split("=", 1) for field in fields[2:])
+    return fields[0], fields[1], environ
+
+
+class HelperDaemon:
+    """Serves push messages forwarded by the shim until it's been idle for
+    idle_timeout seconds."""
+
+    def __init__(self, sock, idle_timeout=DAEMON_IDLE_TIMEOUT,
+                 service=None, click_index=None):
+        self.sock = sock
+        self.idle_timeout = idle_timeout
+        self.service = service
+        self.click_index = click_index
+        self.loop = None
+        self.idle_id = None
+
+    def run(self):
+        import signal
+        from gi.repository import GLib
+
+        self.loop = GLib.MainLoop()
+        GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN, self.accept_cb)
+        # systemd stops us with SIGTERM; leave by the front door, so the
+        # logs get flushed on the way out.
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM,
+                             self.term_cb)
+        self.reset_idle()
+        logging.debug("Listening.")
+        self.loop.run()
+        self.sock.close()
+        if self.service is not None:
+            self.service.shutdown()
+
+    def reset_idle(self):
+        from gi.repository import GLib
+
+        if self.idle_id is not None:
+            GLib.source_remove(self.idle_id)
+        self.idle_id = GLib.timeout_add_seconds(self.idle_timeout,
+                                                self.idle_cb)
+
+    def idle_cb(self):
+        if (self.service is not None and self.service.busy
+                and not self.service.overdue()):
+            # not idle while a check is in flight
+            return True
+        logging.debug("Idle; exiting.")
+        self.idle_id = None
+        self.loop.quit()
+        return False
+
+    def term_cb(self):
+        logging.debug("Terminated; exiting.")
+        self.loop.quit()
+        return False
+
+    def accept_cb(self, fd, condition):
+        try:
+            conn, _addr = self.sock.accept()
+        except OSError:
+            logging.exception("Accepting connection failed:")
+            return True
+        self.reset_idle()
+        with conn:
+            self.serve(conn)
+        return True
+
+    def serve(self, conn):
+        """Handle the single request waiting on conn."""
+        conn.settimeout(FORWARD_TIMEOUT)
+        try:
+            f1, f2, environ = parse_request(conn.makefile("rb").read())
+            logging.debug("Handling %s.", f1)
+            handle(f1, f2, service=self.service, environ=environ,
+                   click_index=self.click_index)
+        except NotReady as e:
+            logging.debug("%s; leaving it to the shim.", e)
+            reply = b"error\n"
+        except Exception:
+            logging.exception("Request failed:")
+            reply = b"error\n"
+        else:
+            reply = b"ok\n"
+        try:
+            conn.sendall(reply)
+        except OSError:
+            logging.debug("Shim went away before we answered.")
+
+
+class LogRing(logging.Handler):
+    """Keeps log records in a bounded in-memory ring.
+
+    Emitting a record renders its message and appends it to the ring; a
+    background thread formats and writes them to target (which must have a
+    flush_batch() method, see setup_logging) in batches every interval
+    seconds, which also keeps log rollover out of the push path. If records
+    come in faster than they are written, the oldest are dropped.
+    """
+
+    def __init__(self, target, size=LOG_RING_SIZE,
+                 interval=LOG_FLUSH_INTERVAL, start=True):
+        super().__init__()
+        # only the message and exception; target does the rest of the line
+        self.setFormatter(logging.Formatter("%(message)s"))
+        self.target = target
+        self.interval = interval
+        self.ring = collections.deque(maxlen=size)
+        self.stopping = threading.Event()
+        self.thread = None
+        if start:
+            self.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.write_loop,
+                                       name="log-writer", daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        self.ring.append(self.prepare(record))
+
+    def prepare(self, record):
+        """Render the message and exception now, as the arguments may
+        well have changed by the time the record is written."""
+        record.msg = record.message = self.format(record)
+        record.args = None
+        record.exc_info = record.exc_text = record.stack_info = None
+        return record
+
+    def write_loop(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write out whatever is buffered."""
+        self.target.acquire()
+        try:
+            while True:
+                try:
+                    record = self.ring.popleft()
+                except IndexError:
+                    break
+                self.target.handle(record)
+            self.target.flush_batch()
+        finally:
+            self.target.release()
+
+    def after_fork(self):
+        """Start over in a forked child, which inherits neither the writer
+        thread nor the state of its lock."""
+        self.target.createLock()
+        self.stopping = threading.Event()
+        self.start()
+
+    def close(self):
+        self.stopping.set()
+        self.flush()
+        self.target.close()
+        super().close()
+
+
+_log_ring = None
+
+
+def flush_logs():
+    if _log_ring is not None:
+        _log_ring.flush()
+
+
+def setup_logging(buffered=True):
+    global _log_ring
+    import logging.handlers
+
+    class BatchedFileHandler(logging.handlers.TimedRotatingFileHandler):
+        """A rotating file handler that only flushes when told to."""
+
+        def flush(self):
+            pass
+
+        def flush_batch(self):
+            super().flush()
+
+    logdir = cache_dir()
     logfile = os.path.join(logdir, "software_updates_helper.log")
-    rothandler = logging.handlers.TimedRotatingFileHandler(logfile, when="D",
-                                                           backupCount=10)
-    logging.basicConfig(
-        format="%(asctime)s %(levelname)8s [%(process)04x] %(message)s",
-        datefmt="%Y-%m-%dT%H:%M:%S",
-        level=logging.DEBUG,
-        handlers=(rothandler,))
+    if buffered:
+        handler = BatchedFileHandler(logfile, when="D", backupCount=10)
+    else:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            logfile, when="D", backupCount=10)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname).1s %(process)x %(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S"))
+    if buffered:
+        # logging.shutdown() flushes and closes it on the way out
+        _log_ring = handler = LogRing(handler)
+    logging.basicConfig(level=logging.DEBUG, handlers=(handler,))
+
+
+def run():
+    """What the shim does when there's no daemon to forward to."""
+    if sys.argv[1:] == ["--daemon"]:
+        setup_logging()
+        logging.debug("Starting daemon.")
+        try:
+            index = BackgroundClickIndex(click_index_path())
+            # so the first click update doesn't have to wait for it
+            index.refresh()
+            HelperDaemon(listening_socket(),
+                         service=UpdateCheckService(broadcast_cache()),
+                         click_index=index).run()
+        except Exception:
+            logging.exception("Daemon died with exception:")
+        sys.exit(0)
+
+    setup_logging()
     logging.debug("Starting.")
     try:
         main()
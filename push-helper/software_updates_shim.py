@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Software Updates Push Notifications helper, as the push client runs it.
+#
+# This is installed as the helper itself, without a .py extension, so it's
+# compiled afresh for every message: keep it small. All it does is hand the
+# message to the daemon, if there is one; only if there isn't does it import
+# software_updates_helper (installed next to it, and byte-compiled) to
+# handle the message in-process. See there for everything else.
+
+import os
+import socket
+import sys
+
+# must match those in software_updates_helper
+LOCALE_VARS = ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")
+FORWARD_TIMEOUT = 2.0
+
+
+def socket_path():
+    """Return the path of the daemon socket, or None if there's no runtime
+    directory to put it in."""
+    rundir = os.environ.get("XDG_RUNTIME_DIR")
+    if not rundir:
+        return None
+    return os.path.join(rundir, "ubuntu-system-settings", "push-helper.socket")
+
+
+def forward(f1, f2, path=None, timeout=FORWARD_TIMEOUT):
+    """Hand the message over to a running daemon.
+
+    Returns True if the daemon handled it, False if the caller should handle
+    it itself. The daemon has a working directory and locale of its own, so
+    it's given absolute paths, and our locale variables: all NUL-separated,
+    up to end of file.
+    """
+    path = path or socket_path()
+    if not path:
+        return False
+    fields = [os.path.abspath(f1), os.path.abspath(f2)]
+    fields.extend(var + "=" + os.environ[var] for var in LOCALE_VARS
+                  if var in os.environ)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall(b"\0".join(map(os.fsencode, fields)))
+        sock.shutdown(socket.SHUT_WR)
+        reply = sock.makefile("rb").readline()
+    except (OSError, socket.timeout):
+        return False
+    finally:
+        sock.close()
+    return reply.strip() == b"ok"
+
+
+if __name__ == '__main__':
+    # the fast path: let the daemon do it, if there is one
+    if len(sys.argv) == 3 and forward(*sys.argv[1:3]):
+        sys.exit(0)
+
+    import software_updates_helper
+    software_updates_helper.run()
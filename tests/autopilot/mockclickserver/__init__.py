@@ -0,0 +1,50 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""A mock of the click store's API, for System Settings' tests.
+
+It serves the click metadata, revisions, tokens and downloads System
+Settings asks for, under network conditions of choice, and counts what it
+served. The autopilot tests run it in-process, the plugin tests as
+`python3 -m mockclickserver`; both can describe what it serves with a
+Scenario.
+"""
+
+from mockclickserver.backends import (
+    BACKENDS,
+    SubprocessServer,
+    create_server,
+)
+from mockclickserver.catalog import (
+    Catalog,
+    catalog,
+    catalog_responses,
+    write_click_command,
+)
+from mockclickserver.cli import main
+from mockclickserver.conditions import PROFILES, Conditions
+from mockclickserver.fixtures import Recorder, Replayer
+from mockclickserver.scenario import Scenario
+from mockclickserver.server import MODES, Manager
+
+__all__ = [
+    'BACKENDS',
+    'Catalog',
+    'Conditions',
+    'MODES',
+    'Manager',
+    'PROFILES',
+    'Recorder',
+    'Replayer',
+    'Scenario',
+    'SubprocessServer',
+    'catalog',
+    'catalog_responses',
+    'create_server',
+    'main',
+    'write_click_command',
+]
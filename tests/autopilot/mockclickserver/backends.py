@@ -0,0 +1,155 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""The ways a server can be run."""
+
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+
+from mockclickserver.server import Manager, Server
+
+# thread: in a thread of this process; asyncio: on an event loop in a
+# thread of this process; subprocess: in a process of its own.
+BACKENDS = ('thread', 'asyncio', 'subprocess')
+
+
+class SubprocessServer(object):
+    """A server in a process of its own, run from the command line, so that
+    serving doesn't compete with the test for this interpreter. It does
+    what a Manager does, but for setting responses once it's started.
+
+    The socket is bound and listening here, then handed to the process, so
+    the port is known at once and connections made while it starts wait
+    rather than fail. start() returns once the process says it's serving.
+    The options are those of Manager that the command line takes too:
+    mode, profile, seed, compress, chunk_size and chunk_delay."""
+
+    def __init__(self, server_address='', server_port=9009, responses=None,
+                 manager=Manager, **options):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((server_address, server_port))
+        self._socket.listen(Server.request_queue_size)
+        self._address = self._socket.getsockname()
+        self._responses = responses or manager.default_responses(
+            self.host, self.port)
+        self._options = options
+        self._process = None
+        self._directory = None
+        self._ready = threading.Event()
+        self._started = False
+
+    @property
+    def host(self):
+        """The host to reach the server at."""
+        host = self._address[0]
+        if host in ('', '0.0.0.0'):
+            host = '127.0.0.1'
+        return host
+
+    @property
+    def port(self):
+        """The port the server is bound to."""
+        return self._address[1]
+
+    def url(self, path=''):
+        """Returns the URL of path on the server."""
+        return 'http://%s:%d%s' % (self.host, self.port, path)
+
+    def set_responses(self, responses):
+        """Replaces the responses to serve; only until it's started."""
+        if self._process:
+            raise RuntimeError('Responses are set before the server starts')
+        self._responses = responses
+
+    def _get_stats(self, query=''):
+        with urllib.request.urlopen(self.url('/__stats' + query)) as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def stats(self):
+        """Returns what Manager.stats() would."""
+        return self._get_stats()
+
+    def requests(self, method=None, route=None):
+        """Returns what Manager.requests() would."""
+        return [
+            request
+            for request in self._get_stats('?requests=1')['log']
+            if method in (None, request['method']) and
+            route in (None, request['route'])
+        ]
+
+    def reset_stats(self):
+        self._get_stats('?reset=1')
+
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _read_output(self):
+        for line in self._process.stdout:
+            if not self._started and 'Started mock update click' in line:
+                self._started = True
+                self._ready.set()
+            sys.stdout.write(line)
+        self._ready.set()
+
+    def start(self, timeout=10):
+        """Starts the process, and returns once it's serving."""
+        self._directory = tempfile.mkdtemp(prefix='mockclickserver')
+        scenario = os.path.join(self._directory, 'scenario.json')
+        with open(scenario, 'w') as f:
+            json.dump({'options': self._options,
+                       'responses': self._responses}, f)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, (
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env.get('PYTHONPATH'))))
+        fd = self._socket.fileno()
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'mockclickserver',
+             '--fd', str(fd), '--scenario', scenario],
+            pass_fds=(fd,), stdout=subprocess.PIPE, env=env,
+            universal_newlines=True)
+        self._socket.close()
+        threading.Thread(target=self._read_output, daemon=True).start()
+        self._ready.wait(timeout)
+        if not self._started:
+            self.stop()
+            raise RuntimeError('Failed to start server')
+
+    def stop(self):
+        if self.is_running():
+            self._process.send_signal(signal.SIGINT)
+            try:
+                self._process.wait(10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+
+def create_server(backend='thread', manager=Manager, **kwargs):
+    """Returns a server, not started yet, run with backend, one of
+    BACKENDS. kwargs are those of manager, a Manager class, whose default
+    responses it serves."""
+    if backend == 'subprocess':
+        return SubprocessServer(manager=manager, **kwargs)
+    if backend == 'asyncio':
+        kwargs['mode'] = 'asyncio'
+    elif backend != 'thread':
+        raise ValueError('Unknown server backend: %s' % backend)
+    return manager(**kwargs)
@@ -0,0 +1,143 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Made-up click packages, for testing at the scale of a well used
+device."""
+
+import collections
+import json
+import os
+import random
+import shlex
+
+from mockclickserver.content import blob_sha512
+
+
+WORDS = (
+    'calendar', 'camera', 'chess', 'clock', 'contacts', 'dekko', 'diary',
+    'docviewer', 'dropping', 'files', 'gallery', 'letters', 'maps', 'media',
+    'music', 'notes', 'player', 'podcast', 'reader', 'reminders', 'share',
+    'shopping', 'stocks', 'sudoku', 'telegram', 'terminal', 'ticker',
+    'timer', 'todo', 'tracker', 'translator', 'tweak', 'weather', 'wiki',
+)
+DEVELOPERS = (
+    'com.ubuntu', 'com.ubuntu.developer', 'io.github', 'org.example',
+)
+
+Catalog = collections.namedtuple(
+    'Catalog', 'packages revisions manifest downloads')
+
+
+def catalog(count, seed=0, address='localhost', port=9009,
+            channel='xenial', updates=1.0, downloads=False):
+    """Returns a Catalog of count made-up click packages: the store's
+    metadata and revisions for them, and what `click list --manifest` says
+    of their installed versions. The same seed makes the same catalog.
+    updates is the share of packages with a newer revision in the store.
+    With downloads, the packages can be downloaded too, and their digests
+    are real; that takes hashing all of them."""
+    rng = random.Random(seed)
+    packages, revisions, manifest, blobs = [], [], [], []
+    names = set()
+    while len(packages) < count:
+        words = rng.sample(WORDS, rng.choice((1, 1, 1, 2)))
+        app = '-'.join(words)
+        name = base = '%s.%s' % (rng.choice(DEVELOPERS), app)
+        while name in names:
+            name = '%s%d' % (base, rng.randint(2, 10 * count))
+        names.add(name)
+
+        # Mostly young projects, now and then a distro style version.
+        version = [rng.choice((0, 0, 0, 1, 1, 2, 3)), rng.randint(0, 20),
+                   rng.randint(0, 30)]
+        suffix = 'ubuntu%d' % rng.randint(1, 3) if rng.random() < 0.15 else ''
+        installed = '%d.%d.%d%s' % tuple(version + [suffix])
+        revision = rng.randint(1, 50)
+        latest = revision
+        if rng.random() < updates:
+            version[2] += 1
+            latest += rng.randint(1, 5)
+        available = '%d.%d.%d%s' % tuple(version + [suffix])
+
+        # Sizes spread over orders of magnitude, around a few MB.
+        filesize = int(min(max(rng.lognormvariate(15, 1.2), 20e3), 500e6))
+        changelog = ''
+        if rng.random() < 0.9:
+            changelog = ' '.join(
+                rng.choice(WORDS)
+                for _ in range(int(rng.lognormvariate(3.4, 0.8)) + 1))
+        icon = ''
+        if rng.random() < 0.9:
+            icon = 'http://%s:%d/icons/%s.png' % (address, port, name)
+        title = ' '.join(word.capitalize() for word in words)
+        download = '/download/%s_%s.click' % (name, available)
+        sha512 = '%0128x' % rng.getrandbits(512)
+        if downloads:
+            sha512 = blob_sha512(download, filesize)
+            blobs.append({
+                'path': download,
+                'status_code': 200,
+                'content_type': 'application/x-click',
+                'size': filesize,
+            })
+
+        packages.append({
+            'id': name,
+            'name': title,
+            'icon': icon,
+            'changelog': changelog,
+            'filesize': filesize,
+            'downloads': [{
+                'channel': channel,
+                'revision': latest,
+                'version': available,
+                'download_url': 'http://%s:%d%s' % (address, port, download),
+                'download_sha512': sha512,
+            }],
+        })
+        revisions.append({
+            'id': name,
+            'revision': revision,
+            'latest_revision': latest,
+        })
+        manifest.append({
+            'name': name,
+            'title': title,
+            'version': installed,
+            'framework': 'ubuntu-sdk-15.04',
+            'hooks': {app: {'desktop': '%s.desktop' % app,
+                            'apparmor': '%s.apparmor' % app}},
+        })
+    return Catalog(packages, revisions, manifest, blobs)
+
+
+def catalog_responses(generated, metadata_path='/metadata',
+                      revision_path='/revision'):
+    """Returns the responses serving a generated Catalog."""
+    return generated.downloads + [
+        {
+            'path': metadata_path,
+            'status_code': 200,
+            'content': {'success': True,
+                        'data': {'packages': generated.packages}},
+        },
+        {
+            'path': revision_path,
+            'status_code': 200,
+            'content': {'success': True, 'data': generated.revisions},
+        },
+    ]
+
+
+def write_click_command(path, manifest):
+    """Writes an executable to path that prints manifest like
+    `click list --manifest` would, to be used as CLICK_COMMAND."""
+    with open(path + '.json', 'w') as f:
+        json.dump(manifest, f)
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\ncat %s\n' % shlex.quote(path + '.json'))
+    os.chmod(path, 0o755)
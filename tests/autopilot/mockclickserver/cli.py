@@ -0,0 +1,174 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""The command line."""
+
+import argparse
+import json
+import sys
+
+from mockclickserver.catalog import write_click_command
+from mockclickserver.conditions import PROFILES
+from mockclickserver.fixtures import Recorder, Replayer
+from mockclickserver.scenario import Scenario
+from mockclickserver.server import MODES, Manager
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='mock click update server')
+
+    parser.add_argument('-a', '--address', default='localhost',
+                        help='address of server (default: localhost)')
+    parser.add_argument('-p', '--port', type=int, default=9009,
+                        help='port of server, 0 for any free one '
+                             '(default: 9009)')
+    parser.add_argument('--fd', type=int, metavar='FD',
+                        help='serve on this listening socket, handed down '
+                             'by whoever started the server, instead of '
+                             'binding one')
+    parser.add_argument('--scenario', metavar='FILE',
+                        help='serve the scenario saved in this file; the '
+                             'options below add to it, or override it')
+
+    parser.add_argument('-r', '--responses',
+                        help='JSON list of responses, by path. '
+                             'Passing a * (asteriks) path will used '
+                             'in all responses. A response may also give '
+                             'a match (exact, prefix or regex) and a '
+                             'priority, serve a file, or made-up '
+                             'bytes of a size, instead of content, and '
+                             'give its own profile.')
+    parser.add_argument('-m', '--mode', choices=MODES,
+                        help='how concurrent requests are served '
+                             '(default: threaded)')
+
+    parser.add_argument('--no-compress', action='store_true',
+                        help='never compress content, whatever clients '
+                             'accept')
+    parser.add_argument('--chunk-size', type=int,
+                        help='send content in chunks of this many bytes '
+                             '(default: in one go)')
+    parser.add_argument('--chunk-delay', type=float,
+                        help='seconds between chunks (default: 0)')
+
+    parser.add_argument('--record', metavar='FIXTURE',
+                        help='pass requests on to --upstream, recording '
+                             'them in this file (compressed if it ends '
+                             'in .gz)')
+    parser.add_argument('--upstream', metavar='URL',
+                        help='server to pass recorded requests on to, '
+                             'e.g. https://open.uappexplorer.com')
+    parser.add_argument('--replay', metavar='FIXTURE',
+                        help='answer requests recorded in this file as '
+                             'they were answered then')
+    parser.add_argument('--replay-timing', action='store_true',
+                        help='take as long to answer replayed requests '
+                             'as it took when they were recorded')
+
+    parser.add_argument('-c', '--catalog', type=int, metavar='COUNT',
+                        help='serve metadata and revisions for this many '
+                             'made-up packages')
+    parser.add_argument('--profile',
+                        help='network conditions: one of %s, or a JSON '
+                             'dictionary like them (default: perfect)' %
+                             ', '.join(sorted(PROFILES)))
+    parser.add_argument('-s', '--seed', type=int,
+                        help='seed of the made-up packages and of network '
+                             'conditions (default: 0)')
+    parser.add_argument('--channel', default='xenial',
+                        help='channel of the made-up packages '
+                             '(default: xenial)')
+    parser.add_argument('--downloads', action='store_true',
+                        help='serve downloads of the made-up packages')
+    parser.add_argument('--click-command', metavar='FILE',
+                        help='write an executable printing the manifest '
+                             'of the made-up packages, to use as '
+                             'CLICK_COMMAND')
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def main(argv=None, manager=Manager):
+    """Runs a server from the command line, serving the default responses
+    of manager, a Manager class, unless told otherwise."""
+    args = parse_args(argv)
+
+    scenario = Scenario()
+    if args.scenario:
+        try:
+            scenario = Scenario.load(args.scenario)
+        except (OSError, ValueError, TypeError) as detail:
+            sys.stderr.write('Could not load scenario: %s\n' % detail)
+            sys.exit(2)
+
+    responses = None
+    if args.responses:
+        try:
+            responses = json.loads(args.responses)
+        except ValueError as detail:
+            sys.stderr.write('Malformed JSON given for '
+                             'responses: %s\n' % detail)
+            sys.exit(2)
+
+        if not isinstance(responses, list):
+            sys.stderr.write('JSON responses must be a list\n')
+            sys.exit(2)
+
+    profile = args.profile
+    if profile is not None and profile not in PROFILES:
+        try:
+            profile = json.loads(profile)
+        except ValueError as detail:
+            sys.stderr.write('Malformed JSON given for '
+                             'profile: %s\n' % detail)
+            sys.exit(2)
+
+        if not isinstance(profile, dict):
+            sys.stderr.write('JSON profile must be a dictionary\n')
+            sys.exit(2)
+
+    fixture = None
+    if args.record:
+        if not args.upstream:
+            sys.stderr.write('Recording needs an --upstream server\n')
+            sys.exit(2)
+        fixture = Recorder(args.record, args.upstream)
+    elif args.replay:
+        fixture = Replayer(args.replay, timing=args.replay_timing)
+
+    for response in responses or []:
+        scenario.add(response)
+    if args.catalog is not None:
+        scenario.catalog(args.catalog, channel=args.channel,
+                         downloads=args.downloads)
+    options = {
+        'mode': args.mode,
+        'profile': profile,
+        'seed': args.seed,
+        'chunk_size': args.chunk_size,
+        'chunk_delay': args.chunk_delay,
+    }
+    scenario.options.update(
+        (name, value) for name, value in options.items() if value is not None)
+    if args.no_compress:
+        scenario.options['compress'] = False
+
+    man = manager(
+        server_address=args.address,
+        server_port=args.port,
+        cmdline=True,
+        fixture=fixture,
+        listen_fd=args.fd,
+        **scenario.options)
+    man.set_responses(scenario.responses(man.host, man.port,
+                                         manager.default_responses))
+    if args.click_command and scenario.generated:
+        write_click_command(args.click_command, scenario.generated.manifest)
+
+    man.start()
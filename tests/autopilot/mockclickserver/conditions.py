@@ -0,0 +1,83 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Network conditions to serve responses under."""
+
+import random
+import threading
+
+
+# Named network conditions. latency and jitter are in seconds (a response
+# is held back by latency plus up to jitter), bandwidth in bytes a second.
+# Of all responses, drop_rate have their connection dropped part way
+# through the body and error_rate get a 503; stall_rate of token (HEAD)
+# requests go unanswered for stall seconds, after which the connection is
+# dropped.
+PROFILES = {
+    'perfect': {},
+    'wifi': {'latency': 0.02, 'jitter': 0.02, 'bandwidth': 2.5e6},
+    '3g': {'latency': 0.2, 'jitter': 0.2, 'bandwidth': 250e3,
+           'drop_rate': 0.02, 'error_rate': 0.01, 'stall_rate': 0.02},
+    'edge': {'latency': 0.6, 'jitter': 0.6, 'bandwidth': 25e3,
+             'drop_rate': 0.05, 'error_rate': 0.05, 'stall_rate': 0.1},
+    'flaky': {'latency': 0.1, 'jitter': 1.0, 'drop_rate': 0.2,
+              'error_rate': 0.2, 'stall_rate': 0.2, 'stall': 10},
+}
+
+
+class Conditions(object):
+    """The network conditions a route is served under, from a profile: one
+    of PROFILES by name, or a dict like them. Chance is seeded, so that the
+    same requests in the same order meet the same fate."""
+
+    def __init__(self, profile, seed):
+        if not isinstance(profile, dict):
+            profile = PROFILES[profile]
+        self.latency = profile.get('latency', 0)
+        self.jitter = profile.get('jitter', 0)
+        self.bandwidth = profile.get('bandwidth', 0)
+        self.drop_rate = profile.get('drop_rate', 0)
+        self.error_rate = profile.get('error_rate', 0)
+        self.stall_rate = profile.get('stall_rate', 0)
+        self.stall = profile.get('stall', 60)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        with self.lock:
+            return self.latency + self.rng.uniform(0, self.jitter)
+
+    def fails(self):
+        return self.chance(self.error_rate)
+
+    def stalls(self):
+        return self.chance(self.stall_rate)
+
+    def drop_point(self, length):
+        """How much of a body of length gets through."""
+        if not length or not self.chance(self.drop_rate):
+            return length
+        with self.lock:
+            return self.rng.randrange(length)
+
+    def chunk_size(self, length):
+        """How much of a body of length to write at a time: all of it,
+        unless the bandwidth is capped."""
+        if not self.bandwidth:
+            return max(length, 1)
+        return max(int(self.bandwidth / 10), 1024)
+
+    def transfer_time(self, length):
+        return length / self.bandwidth if self.bandwidth else 0
@@ -0,0 +1,165 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""What responses are made of: made-up downloads, and content
+serialized and compressed once for all requests."""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import zlib
+
+
+def blob_chunks(name, size, chunk_size=1 << 20):
+    """Yields the made-up contents of the download called name, size bytes
+    long. They are the same every time."""
+    block = random.Random(name).getrandbits(8 * chunk_size).to_bytes(
+        chunk_size, 'little')
+    while size > 0:
+        chunk = block[:size]
+        size -= len(chunk)
+        yield chunk
+
+
+def blob_sha512(name, size):
+    """Returns the sha512 hex digest of a made-up download."""
+    digest = hashlib.sha512()
+    for chunk in blob_chunks(name, size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha512(path):
+    """Returns the sha512 hex digest of the file at path."""
+    digest = hashlib.sha512()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_downloads(responses, address, port):
+    """Returns responses with the metadata in their content pointing at
+    the downloads they serve themselves. A 'download' or 'download_url' that
+    is the path of a response with a 'size' or a 'file' becomes its URL on
+    the server at address and port, and the 'download_sha512' next to it,
+    and any 'filesize' or 'binary_filesize', those of the download."""
+    downloads = {response['path']: response for response in responses
+                 if 'size' in response or 'file' in response}
+    if not downloads:
+        return responses
+    digests = {}
+
+    def describe(download):
+        path = download['path']
+        if path not in digests:
+            if 'file' in download:
+                digests[path] = (file_sha512(download['file']),
+                                 os.path.getsize(download['file']))
+            else:
+                digests[path] = (blob_sha512(path, download['size']),
+                                 download['size'])
+        return digests[path]
+
+    def link(value):
+        if isinstance(value, list):
+            return [link(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        value = {key: link(item) for key, item in value.items()}
+        for key in ('download', 'download_url'):
+            path = value.get(key)
+            if not isinstance(path, str) or path not in downloads:
+                continue
+            sha512, size = describe(downloads[path])
+            value[key] = 'http://%s:%d%s' % (address, port, path)
+            value['download_sha512'] = sha512
+            for size_key in ('filesize', 'binary_filesize'):
+                if size_key in value:
+                    value[size_key] = size
+        return value
+
+    return [dict(response, content=link(response['content']))
+            if 'content' in response else response
+            for response in responses]
+
+
+class Blobs(object):
+    """Made-up downloads, written to a temporary directory when they're
+    first asked for, so that they can be sent straight from the file."""
+
+    def __init__(self):
+        self.directory = None
+        self.lock = threading.Lock()
+
+    def path(self, name, size):
+        with self.lock:
+            if not self.directory:
+                self.directory = tempfile.mkdtemp(prefix='mockclickserver')
+            path = os.path.join(self.directory, hashlib.sha1(
+                ('%s:%d' % (name, size)).encode('utf-8')).hexdigest())
+            if not os.path.exists(path):
+                with open(path + '.tmp', 'wb') as f:
+                    for chunk in blob_chunks(name, size):
+                        f.write(chunk)
+                os.replace(path + '.tmp', path)
+        return path
+
+    def cleanup(self):
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+def negotiate(accept_encoding):
+    """Returns the content coding to answer with, given an Accept-Encoding
+    header: gzip or deflate if acceptable, identity otherwise."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, parameters = item.partition(';')
+        quality = re.search(r'q=([0-9.]+)', parameters)
+        try:
+            accepted[coding.strip().lower()] = (
+                float(quality.group(1)) if quality else 1.0)
+        except ValueError:
+            pass
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return 'identity'
+
+
+def encode(response, coding):
+    """Returns the body of response in content coding, compressing it the
+    first time it's asked for."""
+    body = response.get('body', b'')
+    if coding == 'identity':
+        return body
+    encoded = response.setdefault('encoded', {})
+    if coding not in encoded:
+        if coding == 'gzip':
+            encoded[coding] = gzip.compress(body)
+        else:
+            encoded[coding] = zlib.compress(body)
+    return encoded[coding]
+
+
+def prepare(response):
+    """Returns a copy of response with its content serialized, so that it's
+    done once rather than on every request."""
+    response = dict(response)
+    if 'content' in response:
+        body = json.dumps(response['content']).encode('utf-8')
+        response['body'] = body
+        response['etag'] = '"%s"' % hashlib.sha1(body).hexdigest()
+    return response
@@ -0,0 +1,122 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Recording requests passed on to a real server, and replaying them."""
+
+import base64
+import gzip
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+# Response headers worth keeping from a recording.
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'X-Click-Token')
+
+
+def normalize_body(body):
+    """Returns request body as a string that doesn't depend on how its json
+    was laid out, for looking up recordings by."""
+    if not body:
+        return ''
+    try:
+        return json.dumps(json.loads(body.decode('utf-8')), sort_keys=True,
+                          separators=(',', ':'))
+    except ValueError:
+        return base64.b64encode(body).decode('ascii')
+
+
+def open_fixture(path, mode):
+    """Opens a fixture file, compressed if its name ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class Recorder(object):
+    """Passes requests on to the upstream server, and records them and
+    their responses in a fixture: a json object per line with the method,
+    path and normalized body of the request, the status, headers and body
+    of the response (as json content, or base64 data), and the seconds it
+    took to come."""
+
+    def __init__(self, path, upstream):
+        self.path = path
+        self.upstream = upstream.rstrip('/')
+        self.lock = threading.Lock()
+
+    def respond(self, handler):
+        headers = {
+            name: value for name, value in handler.headers.items()
+            if name.lower() not in ('host', 'connection', 'accept-encoding',
+                                    'content-length')
+        }
+        request = urllib.request.Request(
+            self.upstream + handler.path, data=handler.body or None,
+            headers=headers, method=handler.command)
+        start = time.monotonic()
+        try:
+            response = urllib.request.urlopen(request, timeout=60)
+        except urllib.error.HTTPError as error:
+            response = error
+        except (urllib.error.URLError, OSError) as error:
+            handler.log_message('Upstream failed: %s', error)
+            return None
+        with response:
+            body = response.read()
+        recording = {
+            'method': handler.command,
+            'path': handler.path,
+            'body': normalize_body(handler.body),
+            'status': response.status if hasattr(response, 'status')
+            else response.code,
+            'headers': {name: response.headers[name]
+                        for name in RECORDED_HEADERS
+                        if name in response.headers},
+            'elapsed': round(time.monotonic() - start, 4),
+        }
+        try:
+            recording['content'] = json.loads(body.decode('utf-8'))
+        except ValueError:
+            recording['data'] = base64.b64encode(body).decode('ascii')
+        with self.lock:
+            with open_fixture(self.path, 'a') as f:
+                f.write(json.dumps(recording, separators=(',', ':')) + '\n')
+        return dict(recording, payload=body)
+
+
+class Replayer(object):
+    """Answers requests with the responses recorded for them by a Recorder,
+    looked up by method, path and normalized body. With timing, responses
+    take as long as they took to record."""
+
+    def __init__(self, path, timing=False):
+        self.timing = timing
+        self.recordings = {}
+        with open_fixture(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                recording = json.loads(line)
+                if 'content' in recording:
+                    recording['payload'] = json.dumps(
+                        recording['content']).encode('utf-8')
+                else:
+                    recording['payload'] = base64.b64decode(
+                        recording.get('data', ''))
+                # the last recording of a request wins
+                self.recordings[(recording['method'], recording['path'],
+                                 recording['body'])] = recording
+
+    def respond(self, handler):
+        recording = self.recordings.get(
+            (handler.command, handler.path, normalize_body(handler.body)))
+        if recording and self.timing:
+            handler.pause(recording['elapsed'])
+        return recording
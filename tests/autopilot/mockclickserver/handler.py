@@ -0,0 +1,345 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Handling requests, on a socket or on an asyncio stream."""
+
+import io
+import json
+import os
+import re
+import time
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from mockclickserver.content import encode, negotiate
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    # Keep connections open between requests, so that clients reusing
+    # them can be exercised; unless the server's keep_alive is false.
+    protocol_version = 'HTTP/1.1'
+    # Don't hold on to idle connections forever.
+    timeout = 30
+
+    def conditions_for(self, r):
+        return r['conditions'] if r else self.server.routes.conditions
+
+    def parse_request(self):
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.status = None
+        self.route = ''
+        self.counted = False
+        self.body = b''
+        return BaseHTTPRequestHandler.parse_request(self)
+
+    def handle_one_request(self):
+        self.started = None
+        BaseHTTPRequestHandler.handle_one_request(self)
+        if self.started is not None:
+            self.record()
+
+    def record(self):
+        self.server.stats.record(self, time.monotonic() - self.started)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        BaseHTTPRequestHandler.send_response(self, code, message)
+        if not self.server.keep_alive:
+            # Serving one connection at a time, an idle one would hold up
+            # everyone else.
+            self.send_header("Connection", "close")
+
+    def find_route(self, path):
+        """Returns the response for path, counting the request as served
+        for its route."""
+        r = self.server.routes.find(path)
+        self.route = r['path'] if r else ''
+        self.counted = True
+        self.server.stats.begin(self.route)
+        return r
+
+    def serve_fixture(self):
+        """Answers the request from a recording, or by recording it, if
+        the server does either. Returns whether it did."""
+        fixture = self.server.fixture
+        if not fixture:
+            return False
+        recording = fixture.respond(self)
+        if not recording:
+            return False
+        self.route = self.path
+        self.counted = True
+        self.server.stats.begin(self.route)
+        body = recording['payload']
+        self.send_response(recording['status'])
+        for name, value in recording['headers'].items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        return True
+
+    def do_HEAD(self):
+        """Sends headers.."""
+        if self.serve_fixture():
+            return
+        r = self.find_route(urlparse(self.path).path)
+        conditions = self.conditions_for(r)
+        self.pause(conditions.delay())
+        if conditions.stalls():
+            # The client is left waiting on its token, then given up on.
+            self.pause(conditions.stall)
+            self.drop()
+            return
+        if conditions.fails():
+            self.send_failure()
+            return
+        self.send_response(200)
+        self.send_header("X-Click-Token", "Mock-X-Click-Token")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        """Respond to a POST request."""
+        # Read the request body, or it would be taken for the next request.
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.body = self.rfile.read(length)
+        self.do_GET()
+
+    def do_GET(self):
+        """Respond to a GET request."""
+        o = urlparse(self.path)
+        if o.path == '/__stats':
+            self.send_stats(o)
+            return
+        if self.serve_fixture():
+            return
+        r = self.find_route(o.path)
+
+        if not r:
+            self.log_message('Could not handle request')
+            print(o.path)
+            self.close_connection = True
+            return
+
+        conditions = r['conditions']
+        self.pause(conditions.delay())
+        if conditions.fails():
+            self.send_failure()
+            return
+
+        if 'file' in r or 'size' in r:
+            self.send_download(r)
+            return
+
+        coding = 'identity'
+        if self.server.compress and 'body' in r:
+            coding = negotiate(self.headers.get('Accept-Encoding', ''))
+        body = encode(r, coding)
+        etag = r.get('etag')
+        if etag and coding != 'identity':
+            etag = '%s-%s"' % (etag[:-1], coding)
+        if (etag and self.command == 'GET' and
+                self.headers.get('If-None-Match') == etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        chunk_size = r.get('chunk_size', self.server.chunking[0])
+        chunked = None
+        if chunk_size and body:
+            chunked = (chunk_size,
+                       r.get('chunk_delay', self.server.chunking[1]))
+
+        self.send_response(r['status_code'])
+        self.send_header("Content-type", 'application/json')
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+        if 'body' in r and self.server.compress:
+            self.send_header("Vary", "Accept-Encoding")
+        if coding != 'identity':
+            self.send_header("Content-Encoding", coding)
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+
+        if body:
+            try:
+                self.send_body(body, conditions, chunked)
+            except BrokenPipeError:
+                # System Settings shut down before we finished
+                # up. Log and ignore.
+                self.log_message('Server was interrupted.')
+
+    def send_stats(self, o):
+        """Sends what Stats recorded, with the requests themselves if the
+        query has requests=1, then forgets it all if it has reset=1. Asking
+        isn't recorded."""
+        query = parse_qs(o.query)
+        body = json.dumps(self.server.stats.summary(
+            requests=query.get('requests') == ['1'])).encode('utf-8')
+        if query.get('reset') == ['1']:
+            self.server.stats.reset()
+        self.started = None
+        self.send_response(200)
+        self.send_header("Content-type", 'application/json')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_failure(self):
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_download(self, r):
+        """Sends the file of a download response, or the part of it that
+        was asked for in a Range header."""
+        path = r.get('file') or self.server.blobs.path(r['path'], r['size'])
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = '"%x-%x"' % (size, int(stat.st_mtime))
+        status = r['status_code']
+        start, end = 0, size - 1
+
+        # A single range only; anything else gets the whole file.
+        ranges = re.match(r'bytes=(\d*)-(\d*)$',
+                          self.headers.get('Range', '').strip())
+        if (ranges and any(ranges.groups()) and
+                self.headers.get('If-Range', etag) == etag):
+            first, last = ranges.groups()
+            if not first:
+                start = max(size - int(last), 0)
+            else:
+                start = int(first)
+                if last:
+                    end = min(int(last), end)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-type",
+                         r.get('content_type', 'application/octet-stream'))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if status == 206:
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (start, end, size))
+        self.end_headers()
+        try:
+            self.send_file(path, start, end - start + 1, r['conditions'])
+        except (BrokenPipeError, ConnectionResetError):
+            self.log_message('Server was interrupted.')
+            self.close_connection = True
+
+    def send_body(self, body, conditions, chunked=None):
+        """Writes body as fast, and as far, as conditions allow. With
+        chunked, a (size, delay) pair, body is sent in chunks of size bytes
+        delay seconds apart."""
+        end = conditions.drop_point(len(body))
+        if chunked:
+            step = chunked[0]
+        else:
+            step = conditions.chunk_size(len(body))
+        for start in range(0, end, step):
+            chunk = body[start:min(start + step, end)]
+            if chunked and start:
+                self.pause(chunked[1])
+            self.pause(conditions.transfer_time(len(chunk)))
+            if chunked:
+                chunk = b'%x\r\n' % len(chunk) + chunk + b'\r\n'
+            self.wfile.write(chunk)
+        if end < len(body):
+            self.drop()
+        elif chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def send_file(self, path, offset, count, conditions):
+        """Writes count bytes of the file at path from offset as fast, and
+        as far, as conditions allow."""
+        end = offset + conditions.drop_point(count)
+        step = conditions.chunk_size(count)
+        for start in range(offset, end, step):
+            length = min(step, end - start)
+            self.pause(conditions.transfer_time(length))
+            self.write_file(path, start, length)
+        if end < offset + count:
+            self.drop()
+
+    # What the connection is made to do; the asyncio server queues them
+    # instead.
+
+    def pause(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def write_file(self, path, offset, count):
+        with open(path, 'rb') as f:
+            self.wfile.flush()
+            self.connection.sendfile(f, offset, count)
+
+    def drop(self):
+        """Drops the connection, whatever the client is waiting for."""
+        self.log_message('Dropping connection.')
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class BufferedHandler(Handler):
+    """Handles a single request that was read off an asyncio stream. What
+    should be done on the connection is queued in steps, for the event loop
+    to carry out: ('data', bytes), ('pause', seconds), ('file', path,
+    offset, count) and ('drop',)."""
+
+    def __init__(self, request, client_address, server):
+        self.rfile = io.BytesIO(request)
+        self.wfile = io.BytesIO()
+        self.steps = []
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = True
+        self.handle_one_request()
+        self.step()
+
+    def record(self):
+        # The event loop does, once it carried out the steps.
+        pass
+
+    def step(self, *step):
+        data = self.wfile.getvalue()
+        if data:
+            self.steps.append(('data', data))
+            self.wfile.seek(0)
+            self.wfile.truncate()
+        if step:
+            self.steps.append(step)
+
+    def pause(self, seconds):
+        if seconds > 0:
+            self.step('pause', seconds)
+
+    def write_file(self, path, offset, count):
+        self.step('file', path, offset, count)
+
+    def drop(self):
+        self.log_message('Dropping connection.')
+        self.step('drop')
+        self.close_connection = True
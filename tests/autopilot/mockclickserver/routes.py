@@ -0,0 +1,86 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Finding the response for a request path."""
+
+import collections
+import re
+
+from mockclickserver.conditions import Conditions
+from mockclickserver.content import prepare
+
+
+class Routes(object):
+    """Finds the response for a request path.
+
+    A response's 'path' is matched as its 'match' says: 'exact' (the
+    default), 'prefix' or 'regex'. A path of '*' matches every path, and a
+    path ending in '*' is a prefix. When several responses match, the one
+    with the highest 'priority' (0 if not given) wins; on a tie an exact
+    match beats the longest prefix, which beats the first regular
+    expression, which beats '*'. Of responses with the same path and match,
+    the last one given wins.
+
+    Every response is served under the network conditions of its
+    'profile', or else of the profile given here.
+    """
+
+    EXACT, PREFIX, REGEX, ANY = 3, 2, 1, 0
+
+    def __init__(self, responses, profile='perfect', seed=0):
+        # for requests no response matches
+        self.conditions = Conditions(profile, '%s:' % seed)
+        self.exact = {}
+        self.prefixes = {}
+        regexes = collections.OrderedDict()
+        self.any = None
+        for response in responses:
+            response = prepare(response)
+            path = response['path']
+            response['conditions'] = Conditions(
+                response.get('profile', profile), '%s:%s' % (seed, path))
+            match = response.get('match', 'exact')
+            priority = response.get('priority', 0)
+            if path == '*':
+                if not self.any or self.any[0] <= priority:
+                    self.any = (priority, response)
+            elif match == 'regex':
+                regexes[path] = (priority, re.compile(path), response)
+            elif match == 'prefix' or path.endswith('*'):
+                self.prefixes[path.rstrip('*')] = (priority, response)
+            elif match == 'exact':
+                self.exact[path] = (priority, response)
+            else:
+                raise ValueError('Unknown match for %s: %s' % (path, match))
+        # highest priority first; the sort is stable so ties keep their order
+        self.regexes = sorted(regexes.values(), key=lambda regex: -regex[0])
+        # the few distinct prefix lengths, so lookups don't depend on how
+        # many prefixes there are
+        self.lengths = sorted(set(len(p) for p in self.prefixes),
+                              reverse=True)
+
+    def find(self, path):
+        """Returns the response for path, or None."""
+        candidates = []
+        if path in self.exact:
+            priority, response = self.exact[path]
+            candidates.append((priority, self.EXACT, 0, response))
+        for length in self.lengths:
+            prefix = self.prefixes.get(path[:length])
+            if prefix and len(path) >= length:
+                priority, response = prefix
+                candidates.append((priority, self.PREFIX, length, response))
+        for priority, regex, response in self.regexes:
+            if regex.match(path):
+                candidates.append((priority, self.REGEX, 0, response))
+                break
+        if self.any:
+            priority, response = self.any
+            candidates.append((priority, self.ANY, 0, response))
+        if not candidates:
+            return None
+        return max(candidates, key=lambda c: c[:3])[3]
@@ -0,0 +1,136 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Describing what a server serves, for tests to share."""
+
+import fnmatch
+import json
+
+from mockclickserver.backends import create_server
+from mockclickserver.catalog import catalog, catalog_responses
+from mockclickserver.server import Manager
+
+
+class Scenario(object):
+    """What a server serves, and how, built up a step at a time:
+
+        scenario = (Scenario(profile='3g', seed=1)
+                    .catalog(100, downloads=True)
+                    .respond('/403', 403)
+                    .under('/download/*', 'edge'))
+        server = scenario.start()
+
+    The options are those of Manager that the command line takes too:
+    mode, profile, seed, compress, chunk_size and chunk_delay. Scenarios
+    are saved as json, which the command line loads with --scenario, so
+    that tests running the server in a process of its own can use them
+    too."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.added = []
+        self.catalog_parameters = None
+        self.profiles = []
+        # the Catalog made for the last server, if any
+        self.generated = None
+
+    def add(self, response):
+        """Serves response, a dict like those Manager takes."""
+        self.added.append(response)
+        return self
+
+    def respond(self, path, status_code=200, content=None, **fields):
+        """Serves content, as json, on path with status_code. fields are
+        any others a response may have, e.g. match, priority, size or
+        profile."""
+        response = dict(fields, path=path, status_code=status_code)
+        if content is not None:
+            response['content'] = content
+        return self.add(response)
+
+    def catalog(self, count, **parameters):
+        """Serves the metadata and revisions of count made-up packages, at
+        /metadata and /revision. parameters are those of catalog(); the
+        seed is that of the network conditions unless given."""
+        self.catalog_parameters = dict(parameters, count=count)
+        return self
+
+    def under(self, pattern, profile):
+        """Serves responses whose path matches the shell style pattern, and
+        that have no profile of their own, under the network conditions of
+        profile. The first pattern that matches wins."""
+        self.profiles.append((pattern, profile))
+        return self
+
+    def responses(self, address, port, defaults=None):
+        """Returns the responses for a server at address and port: the
+        catalog's, if any, then those added. With neither, those defaults
+        returns for address and port, if given, are served."""
+        responses = []
+        self.generated = None
+        if self.catalog_parameters is not None:
+            parameters = dict(self.catalog_parameters)
+            parameters.setdefault('seed', self.options.get('seed', 0))
+            self.generated = catalog(address=address, port=port, **parameters)
+            responses = catalog_responses(self.generated)
+        responses = responses + self.added
+        if not responses and defaults:
+            responses = defaults(address, port)
+        return [self._profiled(response) for response in responses]
+
+    def _profiled(self, response):
+        if 'profile' in response:
+            return response
+        for pattern, profile in self.profiles:
+            if fnmatch.fnmatchcase(response['path'], pattern):
+                return dict(response, profile=profile)
+        return response
+
+    def start(self, backend='thread', manager=Manager,
+              server_address='127.0.0.1', server_port=0):
+        """Starts a server with backend, one of BACKENDS, serving the
+        scenario or, if it's empty, the default responses of manager, a
+        Manager class. Returns it once it's serving; by default on any
+        free port, so that test runs don't get in each other's way."""
+        server = create_server(backend, manager,
+                               server_address=server_address,
+                               server_port=server_port, **self.options)
+        server.set_responses(self.responses(
+            server.host, server.port, manager.default_responses))
+        server.start()
+        return server
+
+    def to_json(self):
+        return json.dumps({
+            'options': self.options,
+            'responses': self.added,
+            'catalog': self.catalog_parameters,
+            'profiles': self.profiles,
+        }, indent=2)
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError('A scenario must be a dictionary')
+        scenario = cls(**data.get('options', {}))
+        for response in data.get('responses', []):
+            scenario.add(response)
+        if data.get('catalog') is not None:
+            scenario.catalog(**data['catalog'])
+        for pattern, profile in data.get('profiles', []):
+            scenario.under(pattern, profile)
+        return scenario
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_json() + '\n')
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_json(f.read())
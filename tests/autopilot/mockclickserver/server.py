@@ -0,0 +1,304 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Serving in a thread, on an asyncio event loop, or from the command
+line."""
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+
+from datetime import datetime
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+from mockclickserver.content import Blobs, link_downloads
+from mockclickserver.handler import BufferedHandler, Handler
+from mockclickserver.routes import Routes
+from mockclickserver.stats import Stats
+
+
+# single: one request at a time; threaded: a thread per connection;
+# asyncio: every connection on one event loop.
+MODES = ('single', 'threaded', 'asyncio')
+
+
+def log(msg):
+    fd = sys.stdout
+    fd.write('%s %s\n' % (datetime.now().strftime('%H:%M:%S'), msg))
+    fd.flush()
+
+
+class Server(HTTPServer):
+    # Many clients may connect at once when load testing.
+    request_queue_size = 1024
+
+
+class ThreadedServer(ThreadingMixIn, Server):
+    daemon_threads = True
+
+
+async def read_request(reader):
+    """Reads a request's head and body off reader. Returns b'' when the
+    client has gone away."""
+    lines = []
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line:
+            return b''
+        lines.append(line)
+        if line in (b'\r\n', b'\n'):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value.strip() or 0)
+    if length:
+        lines.append(await reader.readexactly(length))
+    return b''.join(lines)
+
+
+async def write_file(writer, path, offset, count):
+    """Writes count bytes of the file at path from offset to writer, without
+    copying them where the event loop can."""
+    loop = asyncio.get_event_loop()
+    with open(path, 'rb') as f:
+        if hasattr(loop, 'sendfile'):
+            await loop.sendfile(writer.transport, f, offset, count)
+            return
+        f.seek(offset)
+        while count > 0:
+            chunk = f.read(min(count, 1 << 16))
+            if not chunk:
+                break
+            count -= len(chunk)
+            writer.write(chunk)
+            await writer.drain()
+
+
+async def serve_stream(server, writers, reader, writer):
+    """Serves the requests of one connection to the asyncio server."""
+    peer = writer.get_extra_info('peername')
+    writers.add(writer)
+    try:
+        while True:
+            request = await read_request(reader)
+            if not request:
+                break
+            handler = BufferedHandler(request, peer, server)
+            dropped = False
+            try:
+                for step in handler.steps:
+                    if step[0] == 'data':
+                        writer.write(step[1])
+                        await writer.drain()
+                    elif step[0] == 'pause':
+                        await asyncio.sleep(step[1])
+                    elif step[0] == 'file':
+                        await write_file(writer, *step[1:])
+                    elif step[0] == 'drop':
+                        dropped = True
+                        break
+            finally:
+                if handler.started is not None:
+                    Handler.record(handler)
+            if dropped:
+                writer.transport.abort()
+                return
+            if handler.close_connection:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writers.discard(writer)
+        writer.close()
+
+
+class Manager(object):
+
+    def __init__(self, server_address='', server_port=9009, responses=None,
+                 cmdline=False, mode='threaded', profile='perfect', seed=0,
+                 fixture=None, compress=True, chunk_size=0, chunk_delay=0,
+                 listen_fd=None):
+        """Creates and initializes a Manager object. If there's an asterisk
+        in the responses dict, it's used to handle all paths; without
+        responses, default_responses() are served. The mode is one of
+        MODES. Responses without a profile of their own are served under
+        profile, a name in PROFILES or a dict like them; seed seeds the
+        chance in network conditions. With a server_port of 0, a free port
+        is picked; see port. With a listen_fd, the server takes over that
+        socket, bound and listening already, instead. A fixture, a Recorder
+        or Replayer, gets to answer requests before the responses do. With
+        compress, content is compressed for clients that accept it. With a
+        chunk_size, content is sent in chunks of that many bytes,
+        chunk_delay seconds apart; responses may give their own
+        'chunk_size' and 'chunk_delay'."""
+        if mode not in MODES:
+            raise ValueError('Unknown server mode: %s' % mode)
+        self._thread = None
+        self._cmdline = cmdline
+        self._mode = mode
+        self._loop = None
+        self._ready = threading.Event()
+        self._profile = profile
+        self._seed = seed
+        server = ThreadedServer if mode == 'threaded' else Server
+        # In asyncio mode, the event loop takes over the bound socket.
+        if listen_fd is None:
+            self._httpd = server((server_address, server_port), Handler)
+        else:
+            self._httpd = server((server_address, server_port), Handler,
+                                 bind_and_activate=False)
+            self._httpd.socket.close()
+            self._httpd.socket = socket.fromfd(listen_fd, socket.AF_INET,
+                                               socket.SOCK_STREAM)
+            os.close(listen_fd)
+            self._httpd.server_address = self._httpd.socket.getsockname()
+        self.set_responses(
+            responses or self.default_responses(self.host, self.port))
+        self._httpd.blobs = Blobs()
+        self._httpd.stats = Stats()
+        self._httpd.fixture = fixture
+        self._httpd.compress = compress
+        self._httpd.chunking = (chunk_size, chunk_delay)
+        self._httpd.keep_alive = mode != 'single'
+        log('Created mock update click server.')
+
+    @staticmethod
+    def default_responses(address, port):
+        """Returns the responses served when none are given, for a server
+        at address and port."""
+        return [
+            {
+                'path': '/403',
+                'status_code': 403
+            },
+            {
+                'path': '/404',
+                'status_code': 404
+            },
+        ]
+
+    @property
+    def host(self):
+        """The host to reach the server at."""
+        host = self._httpd.server_address[0]
+        if host in ('', '0.0.0.0'):
+            host = '127.0.0.1'
+        return host
+
+    @property
+    def port(self):
+        """The port the server is bound to."""
+        return self._httpd.server_address[1]
+
+    def url(self, path=''):
+        """Returns the URL of path on the server."""
+        return 'http://%s:%d%s' % (self.host, self.port, path)
+
+    def set_responses(self, responses):
+        """Replaces the responses served, e.g. with ones made for the port
+        that was picked. Metadata naming the path of a download served is
+        pointed at it; see link_downloads()."""
+        self._httpd.routes = Routes(
+            link_downloads(responses, self.host, self.port), self._profile,
+            self._seed)
+
+    def stats(self):
+        """Returns how many requests were served, and per route, by method
+        and status, with a histogram of their service times; see Stats.
+        They are also served as json on /__stats."""
+        return self._httpd.stats.summary()
+
+    def requests(self, method=None, route=None):
+        """Returns the requests served, oldest first, optionally only those
+        with method, or for route."""
+        return [
+            request
+            for request in self._httpd.stats.summary(requests=True)['log']
+            if method in (None, request['method']) and
+            route in (None, request['route'])
+        ]
+
+    def reset_stats(self):
+        self._httpd.stats.reset()
+
+    def is_running(self):
+        return self._thread.is_alive()
+
+    def _serve(self):
+        self._ready.set()
+        # Stopping waits for a poll, so don't make it wait long.
+        self._httpd.serve_forever(poll_interval=0.05)
+
+    def _serve_asyncio(self):
+        asyncio.set_event_loop(self._loop)
+        writers = set()
+        server = self._loop.run_until_complete(asyncio.start_server(
+            lambda reader, writer: serve_stream(
+                self._httpd, writers, reader, writer),
+            sock=self._httpd.socket,
+            backlog=self._httpd.request_queue_size))
+        self._loop.call_soon(self._ready.set)
+        self._loop.run_forever()
+        server.close()
+        for writer in list(writers):
+            writer.close()
+        self._loop.run_until_complete(server.wait_closed())
+        self._loop.close()
+
+    def start(self, timeout=10):
+        """Starts serving, and returns once the server is. The socket is
+        listening from the start, so connections made before then wait
+        rather than fail; saying so on stdout is what tells whoever
+        started this process that it can go ahead."""
+        if self._mode == 'asyncio':
+            self._loop = asyncio.new_event_loop()
+            target = self._serve_asyncio
+        else:
+            target = self._serve
+        # Not one to keep a test run from exiting if nobody stops it.
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        try:
+            started = self._ready.wait(timeout)
+            if started:
+                log(
+                    'Started mock update click server on http://%s:%d (%s).'
+                    % (self._httpd.server_address + (self._mode,))
+                )
+
+            # If the command line is the caller, wait for the keyboard
+            # interrupt, which may come as soon as it's said it started.
+            # TODO: infer this by checking sys?
+            if started and self._cmdline:
+                print('Ctrl-C stops this server.')
+                while self.is_running():
+                    self._thread.join(5)
+        except (KeyboardInterrupt, SystemExit):
+            if not self._cmdline:
+                raise
+            print('')
+            self.stop()
+            return
+        if not started:
+            self.stop()
+            raise RuntimeError('Failed to start server')
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        else:
+            self._httpd.shutdown()
+        self._thread.join(timeout=10.0)
+        self._httpd.server_close()
+        self._httpd.blobs.cleanup()
+        if self.is_running():
+            raise RuntimeError('Failed to stop server')
+        log('Stopped mock update click server.')
@@ -0,0 +1,102 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Counting and timing the requests served."""
+
+import bisect
+import collections
+import threading
+
+
+class Stats(object):
+    """Records the requests served, for tests and benchmarks to look at.
+    Requests are counted per route, by the path of the response that
+    answered them ('' for none)."""
+
+    # Upper bounds of the service time histogram's buckets, in seconds. One
+    # more bucket takes the rest.
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, limit=100000):
+        self.lock = threading.Lock()
+        # how many requests are kept in full
+        self.limit = limit
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.total = 0
+            self.requests = collections.deque(maxlen=self.limit)
+            self.routes = {}
+            self.in_flight = collections.Counter()
+
+    def route(self, name):
+        if name not in self.routes:
+            self.routes[name] = {
+                'count': 0,
+                'methods': collections.Counter(),
+                'statuses': collections.Counter(),
+                'histogram': [0] * (len(self.BUCKETS) + 1),
+                'total_time': 0.0,
+                'max_time': 0.0,
+                'max_concurrent': 0,
+            }
+        return self.routes[name]
+
+    def begin(self, route):
+        """Counts a request for route as being served."""
+        with self.lock:
+            self.in_flight[route] += 1
+            entry = self.route(route)
+            entry['max_concurrent'] = max(entry['max_concurrent'],
+                                          self.in_flight[route])
+
+    def record(self, handler, service_time):
+        """Records the request handler served, in service_time seconds."""
+        route = handler.route
+        # Requests that couldn't be parsed have no headers.
+        headers = getattr(handler, 'headers', None) or {}
+        with self.lock:
+            if handler.counted:
+                self.in_flight[route] -= 1
+            self.total += 1
+            entry = self.route(route)
+            entry['count'] += 1
+            entry['methods'][handler.command or ''] += 1
+            entry['statuses'][str(handler.status)] += 1
+            entry['histogram'][bisect.bisect_left(self.BUCKETS,
+                                                  service_time)] += 1
+            entry['total_time'] += service_time
+            entry['max_time'] = max(entry['max_time'], service_time)
+            self.requests.append({
+                'method': handler.command,
+                'path': getattr(handler, 'path', None),
+                'route': route,
+                'headers': dict(headers),
+                'body_size': int(headers.get('Content-Length') or 0),
+                'status': handler.status,
+                'start': handler.started_at,
+                'service_time': service_time,
+            })
+
+    def summary(self, requests=False):
+        """Returns the counts and histograms, and with requests, the
+        requests kept, oldest first."""
+        with self.lock:
+            summary = {
+                'requests': self.total,
+                'buckets': list(self.BUCKETS),
+                'routes': {
+                    route: dict(entry, methods=dict(entry['methods']),
+                                statuses=dict(entry['statuses']),
+                                histogram=list(entry['histogram']))
+                    for route, entry in self.routes.items()
+                },
+            }
+            if requests:
+                summary['log'] = list(self.requests)
+        return summary
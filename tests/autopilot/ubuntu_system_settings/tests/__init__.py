@@ -31,11 +31,13 @@ from autopilot import platform
 from autopilot.matchers import Eventually
 from dbusmock.templates.networkmanager import (InfrastructureMode,
                                                NM80211ApSecurityFlags)
-from fixtures import EnvironmentVariable
+from fixtures import EnvironmentVariable, TempDir
 from gi.repository import UPowerGlib
 from testtools.matchers import Equals, NotEquals, GreaterThan
 from ubuntu_system_settings.utils.mock_update_click_server import (
-    Manager
+    Manager,
+    Scenario,
+    write_click_command,
 )
 from ubuntu_system_settings.tests.connectivity import (
     PRIV_OBJ as CTV_PRIV_OBJ, NETS_OBJ as CTV_NETS_OBJ,
@@ -706,12 +708,33 @@ class SystemUpdatesBaseTestCase(UbuntuSystemSettingsTestCase,
         'Status': 'online'
     }
 
+    # 'catalog' may give the catalog() arguments for made-up packages to
+    # serve, and that click then reports as installed; 'profile' and 'seed'
+    # the network conditions to serve them under; 'backend' one of BACKENDS
+    # to run the server with. The server is started once for all the tests
+    # of a class.
     click_server_parameters = {
         'start': False
     }
 
     systemimage_parameters = {}
 
+    clicksrv_manager = None
+    click_catalog = None
+
+    @classmethod
+    def click_server_scenario(cls):
+        """Returns the Scenario the click server serves, from
+        click_server_parameters."""
+        parameters = cls.click_server_parameters
+        scenario = Scenario(profile=parameters.get('profile', 'perfect'),
+                            seed=parameters.get('seed', 0))
+        for response in parameters.get('responses') or []:
+            scenario.add(response)
+        if parameters.get('catalog'):
+            scenario.catalog(**parameters['catalog'])
+        return scenario
+
     @classmethod
     def setUpClass(cls):
         cls.session_con = cls.get_dbus(False)
@@ -725,9 +748,17 @@ class SystemUpdatesBaseTestCase(UbuntuSystemSettingsTestCase,
 
         super(SystemUpdatesBaseTestCase, cls).setUpClass()
 
+        # Last, so that nothing failing after it keeps it running without
+        # tearDownClass to stop it.
+        if cls.click_server_parameters['start']:
+            scenario = cls.click_server_scenario()
+            cls.clicksrv_manager = scenario.start(
+                backend=cls.click_server_parameters.get('backend', 'thread'),
+                manager=Manager)
+            cls.click_catalog = scenario.generated
+
     def setUp(self):
         """Go to SystemUpdates Page."""
-        self.clicksrv_manager = None
         if is_process_running(INDICATOR_NETWORK):
             _stop_process(INDICATOR_NETWORK)
             self.addCleanup(_start_process, INDICATOR_NETWORK)
@@ -741,11 +772,19 @@ class SystemUpdatesBaseTestCase(UbuntuSystemSettingsTestCase,
             self.session_con.get_object(CTV_IFACE, CTV_NETS_OBJ),
             'org.freedesktop.DBus.Properties')
 
-        if self.click_server_parameters['start']:
-            self.clicksrv_manager = Manager(
-                responses=self.click_server_parameters.get('responses', None)
-            )
-            self.clicksrv_manager.start()
+        if self.clicksrv_manager:
+            self.clicksrv_manager.reset_stats()
+            self.useFixture(EnvironmentVariable(
+                'URL_APPS', self.clicksrv_manager.url('/metadata')))
+            if self.click_catalog:
+                self.useFixture(EnvironmentVariable(
+                    'URL_REVISION', self.clicksrv_manager.url('/revision')))
+                click_command = os.path.join(
+                    self.useFixture(TempDir()).path, 'click')
+                write_click_command(click_command,
+                                    self.click_catalog.manifest)
+                self.useFixture(
+                    EnvironmentVariable('CLICK_COMMAND', click_command))
 
         super(SystemUpdatesBaseTestCase, self).setUp()
         self.main_view.click_item('entryComponent-system-update')
@@ -753,14 +792,15 @@ class SystemUpdatesBaseTestCase(UbuntuSystemSettingsTestCase,
     def tearDown(self):
         self.ctv_mock.terminate()
         self.ctv_mock.wait()
-        if self.clicksrv_manager and self.clicksrv_manager.is_running():
-            self.clicksrv_manager.stop()
         super(SystemUpdatesBaseTestCase, self).tearDown()
 
     @classmethod
     def tearDownClass(cls):
         cls.si_mock.terminate()
         cls.si_mock.wait()
+        if cls.clicksrv_manager and cls.clicksrv_manager.is_running():
+            cls.clicksrv_manager.stop()
+        cls.clicksrv_manager = None
         if dbusmock.DBusTestCase.system_bus_pid is not None:
             cls.stop_dbus(dbusmock.DBusTestCase.system_bus_pid)
             del os.environ['DBUS_SYSTEM_BUS_ADDRESS']
@@ -1168,8 +1208,10 @@ class WifiBaseTestCase(UbuntuSystemSettingsTestCase,
         cls.session_con = cls.get_dbus(False)
 
         template = os.path.join(os.path.dirname(__file__), 'networkmanager.py')
+        # Nobody reads its log, which fills a pipe once StartChurn gets
+        # going, and then blocks the mock.
         (cls.p_mock, cls.obj_nm) = cls.spawn_server_template(
-            template, stdout=subprocess.PIPE)
+            template, stdout=subprocess.DEVNULL)
         super(WifiBaseTestCase, cls).setUpClass()
 
     def setUp(self, panel=None):
@@ -14,10 +14,16 @@ property such as 'NetworkingEnabled', or 'WirelessEnabled' etc. in
 
 from dbusmock import MOCK_IFACE
 import binascii
+import bisect
+import collections
 import dbus
 import dbusmock
+import random
+import time
 import uuid
 
+from gi.repository import GLib
+
 __author__ = 'Iftikhar Ahmad'
 __email__ = 'iftikhar.ahmad@canonical.com'
 __copyright__ = '(c) 2012 Canonical Ltd.'
@@ -36,6 +42,17 @@ ACTIVE_CONNECTION_IFACE = 'org.freedesktop.NetworkManager.Connection.Active'
 ACTIVE_CONNECTION_PATH = '/org/freedesktop/NetworkManager/ActiveConnection/'
 SYSTEM_BUS = True
 
+# How likely each kind of churn event is, unless StartChurn is told
+# otherwise.
+CHURN_WEIGHTS = {
+    'strength': 0.85,
+    'add': 0.05,
+    'remove': 0.05,
+    'flip': 0.05,
+}
+CHURN_SSIDS = ('Airport', 'Cafe', 'Guest', 'Home', 'Hotel', 'Library',
+               'Office', 'Public')
+
 
 class NMState:
     '''Global state
@@ -197,15 +214,23 @@ def add_and_activate_connection(self, conn_conf, dev, ap):
     return (wifi_conn, active_conn)
 
 
+def stop_churn(mock):
+    if getattr(mock, 'churn_source', None):
+        GLib.source_remove(mock.churn_source)
+    mock.churn_source = None
+
+
 def load(mock, parameters):
+    # Reset leaves timeouts running.
+    stop_churn(mock)
+    mock.churn_count = 0
+    # The devices by path, in the order they were added.
+    mock.devices = collections.OrderedDict()
     mock.activate_connection = activate_connection
     mock.deactivate_connection = deactivate_connection
     mock.add_and_activate_connection = add_and_activate_connection
     mock.AddMethods(MAIN_IFACE, [
-        (
-            'GetDevices', '', 'ao',
-            'ret = [k for k in objects.keys() if "/Devices" in k]'
-        ),
+        ('GetDevices', '', 'ao', 'ret = list(self.devices)'),
         ('GetPermissions', '', 'a{ss}', 'ret = {}'),
         ('state', '', 'u', "ret = self.Get('%s', 'State')" % MAIN_IFACE),
         (
@@ -342,6 +367,11 @@ def SetDeviceDisconnected(self, device_path):
     )
 
 
+def add_device(self, path, obj):
+    self.devices[path] = obj
+    self.Set(MAIN_IFACE, 'Devices', dbus.Array(self.devices, signature='o'))
+
+
 @dbus.service.method(MOCK_IFACE,
                      in_signature='ssi', out_signature='s')
 def AddEthernetDevice(self, device_name, iface_name, state):
@@ -377,9 +407,7 @@ def AddEthernetDevice(self, device_name, iface_name, state):
     obj = dbusmock.get_object(path)
     obj.AddProperties(DEVICE_IFACE, props)
 
-    devices = self.Get(MAIN_IFACE, 'Devices')
-    devices.append(path)
-    self.Set(MAIN_IFACE, 'Devices', devices)
+    add_device(self, path, obj)
 
     self.EmitSignal(
         'org.freedesktop.NetworkManager', 'DeviceAdded', 'o', [path]
@@ -418,14 +446,23 @@ def AddWiFiDevice(self, device_name, iface_name, state):
                    },
                    [
                        ('GetAccessPoints', '', 'ao',
-                        'ret = self.access_points'),
+                        "ret = self.Get('%s', 'AccessPoints')" %
+                        WIRELESS_DEVICE_IFACE),
                        ('GetAllAccessPoints', '', 'ao',
-                        'ret = self.access_points'),
+                        "ret = self.Get('%s', 'AccessPoints')" %
+                        WIRELESS_DEVICE_IFACE),
                        ('RequestScan', 'a{sv}', '', ''),
                    ])
 
     dev_obj = dbusmock.get_object(path)
-    dev_obj.access_points = []
+    # The access points by path, in the order they were added, their paths
+    # by SSID, and where each is in the AccessPoints property, so that scan
+    # lists of thousands of them are built, searched and changed without
+    # walking them all.
+    dev_obj.access_points = collections.OrderedDict()
+    dev_obj.ssid_access_points = {}
+    dev_obj.access_point_indexes = {}
+    dev_obj.access_points_source = None
     dev_obj.AddProperties(
         DEVICE_IFACE,
         {
@@ -441,9 +478,7 @@ def AddWiFiDevice(self, device_name, iface_name, state):
         }
     )
 
-    devices = self.Get(MAIN_IFACE, 'Devices')
-    devices.append(path)
-    self.Set(MAIN_IFACE, 'Devices', devices)
+    add_device(self, path, dev_obj)
 
     self.EmitSignal(
         'org.freedesktop.NetworkManager', 'DeviceAdded', 'o', [path]
@@ -452,6 +487,141 @@ def AddWiFiDevice(self, device_name, iface_name, state):
     return path
 
 
+def add_access_point(self, dev_obj, ap_name, ssid, hw_address,
+                     mode, frequency, rate, strength, security):
+    ap_path = '/org/freedesktop/NetworkManager/AccessPoint/' + ap_name
+
+    flags = NM80211ApFlags.NM_802_11_AP_FLAGS_PRIVACY
+    if security == NM80211ApSecurityFlags.NM_802_11_AP_SEC_NONE:
+        flags = NM80211ApFlags.NM_802_11_AP_FLAGS_NONE
+
+    raw_ssid = ssid.encode('UTF-8')
+    self.AddObject(ap_path,
+                   ACCESS_POINT_IFACE,
+                   {'Ssid': dbus.ByteArray(raw_ssid),
+                    'HwAddress': dbus.String(hw_address),
+                    'Flags': dbus.UInt32(flags),
+                    'LastSeen': dbus.Int32(1),
+                    'Frequency': dbus.UInt32(frequency),
+                    'MaxBitrate': dbus.UInt32(rate),
+                    'Mode': dbus.UInt32(mode),
+                    'RsnFlags': dbus.UInt32(security),
+                    'WpaFlags': dbus.UInt32(security),
+                    'Strength': dbus.Byte(strength)},
+                   [])
+
+    dev_obj.access_points[ap_path] = dbusmock.get_object(ap_path)
+    dev_obj.ssid_access_points.setdefault(
+        raw_ssid, collections.OrderedDict())[ap_path] = None
+
+    return ap_path
+
+
+def forget_access_point(dev_obj, ap_path):
+    ap_obj = dev_obj.access_points.pop(ap_path)
+    ssid = bytes(ap_obj.Get(ACCESS_POINT_IFACE, 'Ssid'))
+    ap_paths = dev_obj.ssid_access_points[ssid]
+    del ap_paths[ap_path]
+    if not ap_paths:
+        del dev_obj.ssid_access_points[ssid]
+
+
+def list_access_points(dev_obj, ap_paths):
+    '''Appends ap_paths to the device's AccessPoints property, in place.'''
+    aps = dev_obj.Get(WIRELESS_DEVICE_IFACE, 'AccessPoints')
+    for ap_path in ap_paths:
+        dev_obj.access_point_indexes[ap_path] = len(aps)
+        aps.append(dbus.ObjectPath(ap_path))
+    access_points_changed(dev_obj)
+
+
+def unlist_access_point(dev_obj, ap_path):
+    '''Takes ap_path out of the device's AccessPoints property, in place.
+    The last access point takes its place; NetworkManager doesn't keep them
+    in any order either.'''
+    aps = dev_obj.Get(WIRELESS_DEVICE_IFACE, 'AccessPoints')
+    index = dev_obj.access_point_indexes.pop(ap_path)
+    last = aps.pop()
+    if index < len(aps):
+        aps[index] = last
+        dev_obj.access_point_indexes[str(last)] = index
+    access_points_changed(dev_obj)
+
+
+def access_points_changed(dev_obj):
+    '''Announces the device's AccessPoints property a little later, once
+    for all the changes made meanwhile, as NetworkManager batches property
+    changes. Sending the whole list for each change would take time in
+    the square of the number of access points.'''
+    if dev_obj.access_points_source:
+        return
+
+    def emit():
+        dev_obj.access_points_source = None
+        # The mock may have been reset since.
+        if (dev_obj.path not in dbusmock.get_objects() or
+                dbusmock.get_object(dev_obj.path) is not dev_obj):
+            return False
+        dev_obj.EmitSignal(
+            'org.freedesktop.DBus.Properties', 'PropertiesChanged', 'sa{sv}as',
+            [WIRELESS_DEVICE_IFACE,
+             dbus.Dictionary({'AccessPoints': dev_obj.Get(
+                 WIRELESS_DEVICE_IFACE, 'AccessPoints')}, signature='sv'),
+             dbus.Array([], signature='s')])
+        return False
+
+    dev_obj.access_points_source = GLib.timeout_add(100, emit)
+
+
+def glib_rate(rate):
+    '''How to do something rate times a second with a GLib timeout.
+
+    Returns the interval in milliseconds to fire the timeout at, and a
+    function to call each time it fires, saying how many times to do it then.
+    GLib can't time much more often than every 10ms, and the interval only
+    restarts once the callback returns, so rather than trust the timing that
+    works out how many are due from the time since the first call, carrying
+    fractions over to the next time.
+    '''
+    start = time.monotonic()
+    done = 0
+
+    def due():
+        nonlocal done
+        total = int((time.monotonic() - start) * rate)
+        count, done = total - done, total
+        return count
+
+    return max(int(1000 / rate), 10), due
+
+
+def emit_access_points_added(dev_obj, ap_paths, rate):
+    if rate <= 0:
+        for ap_path in ap_paths:
+            dev_obj.EmitSignal(
+                WIRELESS_DEVICE_IFACE, 'AccessPointAdded', 'o', [ap_path]
+            )
+        return
+
+    interval, due = glib_rate(rate)
+    pending = collections.deque(ap_paths)
+
+    def emit_next():
+        emitted = 0
+        count = due()
+        while pending and emitted < count:
+            ap_path = pending.popleft()
+            # Access points removed meanwhile aren't announced.
+            if ap_path in dev_obj.access_points:
+                dev_obj.EmitSignal(
+                    WIRELESS_DEVICE_IFACE, 'AccessPointAdded', 'o', [ap_path]
+                )
+                emitted += 1
+        return bool(pending)
+
+    GLib.timeout_add(interval, emit_next)
+
+
 @dbus.service.method(MOCK_IFACE,
                      in_signature='ssssuuuyu', out_signature='s')
 def AddAccessPoint(self, dev_path, ap_name, ssid, hw_address,
@@ -476,29 +646,9 @@ def AddAccessPoint(self, dev_path, ap_name, ssid, hw_address,
                                                              dev_path),
             name=MAIN_IFACE + '.AlreadyExists')
 
-    flags = NM80211ApFlags.NM_802_11_AP_FLAGS_PRIVACY
-    if security == NM80211ApSecurityFlags.NM_802_11_AP_SEC_NONE:
-        flags = NM80211ApFlags.NM_802_11_AP_FLAGS_NONE
-
-    self.AddObject(ap_path,
-                   ACCESS_POINT_IFACE,
-                   {'Ssid': dbus.ByteArray(ssid.encode('UTF-8')),
-                    'HwAddress': dbus.String(hw_address),
-                    'Flags': dbus.UInt32(flags),
-                    'LastSeen': dbus.Int32(1),
-                    'Frequency': dbus.UInt32(frequency),
-                    'MaxBitrate': dbus.UInt32(rate),
-                    'Mode': dbus.UInt32(mode),
-                    'RsnFlags': dbus.UInt32(security),
-                    'WpaFlags': dbus.UInt32(security),
-                    'Strength': dbus.Byte(strength)},
-                   [])
-
-    dev_obj.access_points.append(ap_path)
-
-    aps = dev_obj.Get(WIRELESS_DEVICE_IFACE, 'AccessPoints')
-    aps.append(ap_path)
-    dev_obj.Set(WIRELESS_DEVICE_IFACE, 'AccessPoints', aps)
+    add_access_point(self, dev_obj, ap_name, ssid, hw_address,
+                     mode, frequency, rate, strength, security)
+    list_access_points(dev_obj, [ap_path])
 
     dev_obj.EmitSignal(
         WIRELESS_DEVICE_IFACE, 'AccessPointAdded', 'o', [ap_path]
@@ -507,6 +657,80 @@ def AddAccessPoint(self, dev_path, ap_name, ssid, hw_address,
     return ap_path
 
 
+@dbus.service.method(MOCK_IFACE,
+                     in_signature='saa{sv}d', out_signature='as')
+def AddAccessPoints(self, dev_path, access_points, signal_rate):
+    '''Add many access points to an existing WiFi device at once.
+
+    You have to specify WiFi Device path and a dictionary per access point,
+    with a 'name' and an 'ssid'. 'hw_address', 'mode', 'frequency', 'rate',
+    'strength' and 'security' are as for AddAccessPoint, and default to
+    those of an open infrastructure network with a good signal.
+
+    The AccessPoints property is updated once. With a signal_rate of 0, the
+    AccessPointAdded signals are all emitted before this returns, otherwise
+    at signal_rate a second.
+
+    Please note that this does not set any global properties.
+
+    Returns the new object paths.
+    '''
+    dev_obj = dbusmock.get_object(dev_path)
+
+    # Don't add any if some can't be.
+    names = set()
+    for ap in access_points:
+        missing = [key for key in ('name', 'ssid') if key not in ap]
+        if missing:
+            raise dbus.exceptions.DBusException(
+                'Access point %s on device %s has no %s' % (
+                    ap.get('name', len(names)), dev_path,
+                    ' or '.join(missing)),
+                name=MAIN_IFACE + '.InvalidArgs')
+        ap_name = ap['name']
+        ap_path = '/org/freedesktop/NetworkManager/AccessPoint/' + ap_name
+        try:
+            dbus.ObjectPath(ap_path)
+        except ValueError:
+            raise dbus.exceptions.DBusException(
+                'Access point name %s on device %s is not valid in an '
+                'object path' % (ap_name, dev_path),
+                name=MAIN_IFACE + '.InvalidArgs')
+        # Another device's access point, or any other object, may have the
+        # path too.
+        if ap_path in dbusmock.get_objects() or ap_name in names:
+            raise dbus.exceptions.DBusException(
+                'Access point %s on device %s already exists' % (ap_name,
+                                                                 dev_path),
+                name=MAIN_IFACE + '.AlreadyExists')
+        names.add(ap_name)
+
+    ap_paths = []
+    try:
+        for ap in access_points:
+            ap_paths.append(add_access_point(
+                self, dev_obj, ap['name'], ap['ssid'],
+                ap.get('hw_address', '00:16:3e:00:00:00'),
+                ap.get('mode', InfrastructureMode.NM_802_11_MODE_INFRA),
+                ap.get('frequency', 2425),
+                ap.get('rate', 5400),
+                ap.get('strength', 82),
+                ap.get('security',
+                       NM80211ApSecurityFlags.NM_802_11_AP_SEC_NONE)))
+    except Exception:
+        # e.g. a property out of range; take back those already added.
+        for ap_path in ap_paths:
+            forget_access_point(dev_obj, ap_path)
+            self.RemoveObject(ap_path)
+        raise
+
+    list_access_points(dev_obj, ap_paths)
+
+    emit_access_points_added(dev_obj, ap_paths, signal_rate)
+
+    return ap_paths
+
+
 @dbus.service.method(MOCK_IFACE,
                      in_signature='ssssa{sa{sv}}', out_signature='s')
 def AddWiFiConnection(self, dev_path, connection_name, ssid_name, key_mgmt,
@@ -533,18 +757,13 @@ def AddWiFiConnection(self, dev_path, connection_name, ssid_name, key_mgmt,
     ssid = ssid_name.encode('UTF-8')
 
     # Find the access point by ssid
-    access_point = None
-    access_points = dev_obj.access_points
-    for ap_path in access_points:
-        ap = dbusmock.get_object(ap_path)
-        if ap.Get(ACCESS_POINT_IFACE, 'Ssid') == ssid:
-            access_point = ap
-            break
-
-    if not access_point:
+    ap_paths = dev_obj.ssid_access_points.get(ssid)
+    if not ap_paths:
         raise dbus.exceptions.DBusException(
             'Access point with SSID [%s] could not be found' % (ssid_name),
             name=MAIN_IFACE + '.DoesNotExist')
+    ap_path = next(iter(ap_paths))
+    access_point = dev_obj.access_points[ap_path]
 
     hw_address = access_point.Get(ACCESS_POINT_IFACE, 'HwAddress')
     mode = access_point.Get(ACCESS_POINT_IFACE, 'Mode')
@@ -683,11 +902,8 @@ def RemoveAccessPoint(self, dev_path, ap_path):
 
     dev_obj = dbusmock.get_object(dev_path)
 
-    aps = dev_obj.Get(WIRELESS_DEVICE_IFACE, 'AccessPoints')
-    aps.remove(ap_path)
-    dev_obj.Set(WIRELESS_DEVICE_IFACE, 'AccessPoints', aps)
-
-    dev_obj.access_points.remove(ap_path)
+    forget_access_point(dev_obj, ap_path)
+    unlist_access_point(dev_obj, ap_path)
 
     dev_obj.EmitSignal(
         WIRELESS_DEVICE_IFACE, 'AccessPointRemoved', 'o', [ap_path]
@@ -956,3 +1172,158 @@ def ConnectionDelete(self, connection_path):
     connection_obj = dbusmock.get_object(connection_path)
     connection_obj.EmitSignal(CSETTINGS_IFACE, 'Removed', '', [])
     self.RemoveObject(connection_path)
+
+
+def churn_in_use(dev_obj):
+    active = dev_obj.Get(DEVICE_IFACE, 'ActiveConnection')
+    if active == '/':
+        return None
+    return dbusmock.get_object(active).Get(
+        ACTIVE_CONNECTION_IFACE, 'SpecificObject')
+
+
+def churn_strength(self, rng, dev_path, dev_obj, ap_paths):
+    ap_obj = dev_obj.access_points.get(rng.choice(ap_paths))
+    if not ap_obj:
+        return
+    strength = ap_obj.Get(ACCESS_POINT_IFACE, 'Strength')
+    strength = dbus.Byte(min(max(strength + rng.randint(-15, 15), 0), 100))
+    last_seen = dbus.Int32(int(time.monotonic()))
+    ap_obj.Set(ACCESS_POINT_IFACE, 'Strength', strength)
+    ap_obj.Set(ACCESS_POINT_IFACE, 'LastSeen', last_seen)
+    ap_obj.EmitSignal(
+        ACCESS_POINT_IFACE, 'PropertiesChanged', 'a{sv}',
+        [{'Strength': strength, 'LastSeen': last_seen}]
+    )
+
+
+def churn_add(self, rng, dev_path, dev_obj, ap_paths):
+    self.churn_count += 1
+    mac = [0x00, 0x16, 0x3e] + [rng.randint(0x00, 0xff) for _ in range(3)]
+    AddAccessPoint(
+        self, dev_path, 'churn%d' % self.churn_count,
+        '%s %d' % (rng.choice(CHURN_SSIDS), rng.randint(1, 99)),
+        ':'.join('%02x' % byte for byte in mac),
+        InfrastructureMode.NM_802_11_MODE_INFRA,
+        rng.choice((2412, 2437, 2462, 5180, 5240)), 54000,
+        rng.randint(5, 100),
+        rng.choice((NM80211ApSecurityFlags.NM_802_11_AP_SEC_NONE,
+                    NM80211ApSecurityFlags.NM_802_11_AP_SEC_KEY_MGMT_PSK)))
+
+
+def churn_remove(self, rng, dev_path, dev_obj, ap_paths):
+    ap_path = rng.choice(ap_paths)
+    # The access point in use stays.
+    if (ap_path not in dev_obj.access_points or
+            ap_path == churn_in_use(dev_obj)):
+        return
+    RemoveAccessPoint(self, dev_path, ap_path)
+
+
+def churn_flip(self, rng, dev_path, dev_obj, ap_paths):
+    active = dev_obj.Get(DEVICE_IFACE, 'ActiveConnection')
+    if active != '/':
+        deactivate_connection(self, active)
+        return
+    connections = dev_obj.Get(DEVICE_IFACE, 'AvailableConnections')
+    if not connections:
+        return
+    connection = rng.choice(connections)
+    settings = dbusmock.get_object(connection).Get(CSETTINGS_IFACE,
+                                                   'Settings')
+    ssid = bytes(settings.get('802-11-wireless', {}).get('ssid', b''))
+    ssid_paths = dev_obj.ssid_access_points.get(ssid)
+    # Out of range, as far as the scan goes.
+    if not ssid_paths:
+        return
+    activate_connection(self, connection, dev_path, next(iter(ssid_paths)))
+
+
+CHURN_EVENTS = {
+    'strength': churn_strength,
+    'add': churn_add,
+    'remove': churn_remove,
+    'flip': churn_flip,
+}
+
+
+def churn(self, events, cumulative, due):
+    rng = self.churn_rng
+    count = due()
+    devices = [(dev_path, dev_obj)
+               for dev_path, dev_obj in self.devices.items()
+               if hasattr(dev_obj, 'access_points')]
+    if not devices:
+        return True
+
+    # Access point paths by device, listed once for all events of a tick
+    # that don't add or remove any.
+    ap_paths = {}
+    for _ in range(count):
+        event = events[bisect.bisect(cumulative,
+                                     rng.random() * cumulative[-1])]
+        dev_path, dev_obj = rng.choice(devices)
+        if dev_path not in ap_paths:
+            ap_paths[dev_path] = list(dev_obj.access_points)
+        if event != 'add' and not ap_paths[dev_path]:
+            continue
+        CHURN_EVENTS[event](self, rng, dev_path, dev_obj, ap_paths[dev_path])
+        if event in ('add', 'remove'):
+            del ap_paths[dev_path]
+    return True
+
+
+@dbus.service.method(MOCK_IFACE,
+                     in_signature='uda{sd}', out_signature='')
+def StartChurn(self, seed, events_per_second, weights):
+    '''Start changing the access points of WiFi devices, as scans do.
+
+    You have to specify a seed, so that the same calls on the same mock make
+    the same changes, how many events happen a second, and how likely each
+    kind of event is, relative to the others; those not given are as in
+    CHURN_WEIGHTS. The events are:
+        * strength: an access point's Strength changes and it's seen again,
+        * add: a new access point appears,
+        * remove: an access point not in use goes away,
+        * flip: a device's active connection is deactivated, or one of its
+          available connections activated, if an access point with its SSID
+          is in sight.
+
+    Any churn already going on is stopped first.
+    '''
+    if events_per_second <= 0:
+        raise dbus.exceptions.DBusException(
+            'Churn needs a positive rate, not %s' % events_per_second,
+            name=MAIN_IFACE + '.InvalidArgs')
+    unknown = set(weights) - set(CHURN_WEIGHTS)
+    if unknown:
+        raise dbus.exceptions.DBusException(
+            'Unknown churn events: %s' % ', '.join(sorted(unknown)),
+            name=MAIN_IFACE + '.InvalidArgs')
+    weights = dict(CHURN_WEIGHTS, **{
+        str(event): float(weight) for event, weight in weights.items()
+    })
+    events = sorted(event for event in weights if weights[event] > 0)
+    if not events:
+        raise dbus.exceptions.DBusException(
+            'Churn needs some event to happen',
+            name=MAIN_IFACE + '.InvalidArgs')
+
+    cumulative = []
+    total = 0.0
+    for event in events:
+        total += weights[event]
+        cumulative.append(total)
+
+    stop_churn(self)
+    self.churn_rng = random.Random(seed)
+    interval, due = glib_rate(events_per_second)
+    self.churn_source = GLib.timeout_add(
+        interval, churn, self, events, cumulative, due)
+
+
+@dbus.service.method(MOCK_IFACE,
+                     in_signature='', out_signature='')
+def StopChurn(self):
+    '''Stop changing the access points of WiFi devices.'''
+    stop_churn(self)
@@ -0,0 +1,420 @@
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+# Copyright 2016 Canonical
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+
+"""Tests for the NetworkManager mock template itself, which don't need
+System Settings running."""
+
+import os
+import subprocess
+import time
+
+import dbus
+import dbus.mainloop.glib
+import dbusmock
+from gi.repository import GLib
+
+from dbusmock.templates.networkmanager import (
+    NM80211ApSecurityFlags,
+    InfrastructureMode,
+)
+
+NM_SERVICE = 'org.freedesktop.NetworkManager'
+DEVICE_IFACE = 'org.freedesktop.NetworkManager.Device.Wireless'
+
+dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+
+class NetworkManagerMockTestCase(dbusmock.DBusTestCase):
+    """Runs the template on a private system bus, with a WiFi device."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(NetworkManagerMockTestCase, cls).setUpClass()
+        cls.start_system_bus()
+        cls.dbus_con = cls.get_dbus(True)
+        template = os.path.join(os.path.dirname(__file__), 'networkmanager.py')
+        # Churn makes the mock log a lot, more than a pipe nobody reads
+        # takes.
+        (cls.p_mock, cls.obj_nm) = cls.spawn_server_template(
+            template, stdout=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.p_mock.terminate()
+        cls.p_mock.wait()
+        super(NetworkManagerMockTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        super(NetworkManagerMockTestCase, self).setUp()
+        self.obj_nm.Reset()
+        self.device_path = self.obj_nm.AddWiFiDevice('test0', 'wlan0', 100)
+        self.device = dbus.Interface(
+            self.dbus_con.get_object(NM_SERVICE, self.device_path),
+            DEVICE_IFACE)
+        # Signals from before the reset aren't ours.
+        context = GLib.MainContext.default()
+        while context.iteration(False):
+            pass
+        self.added = []
+        match = self.dbus_con.add_signal_receiver(
+            self.added.append, 'AccessPointAdded', DEVICE_IFACE,
+            path=self.device_path)
+        self.addCleanup(match.remove)
+
+    def access_points(self):
+        """The device's access points, as the property and the method list
+        them."""
+        listed = self.device.GetAccessPoints()
+        self.assertEqual(
+            self.device.Get(DEVICE_IFACE, 'AccessPoints',
+                            dbus_interface=dbus.PROPERTIES_IFACE),
+            listed)
+        return [str(path) for path in listed]
+
+    def wait_for(self, condition, timeout=5):
+        """Runs the main loop until condition() holds."""
+        context = GLib.MainContext.default()
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            context.iteration(False) or time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def add_access_point(self, name, ssid):
+        return str(self.obj_nm.AddAccessPoint(
+            self.device_path, name, ssid, '00:16:3e:00:00:01',
+            InfrastructureMode.NM_802_11_MODE_INFRA, 2425, 5400, 82,
+            NM80211ApSecurityFlags.NM_802_11_AP_SEC_NONE))
+
+
+class AddAccessPointsTestCase(NetworkManagerMockTestCase):
+
+    def test_add(self):
+        paths = self.obj_nm.AddAccessPoints(
+            self.device_path,
+            [{'name': 'ap%d' % i, 'ssid': 'net%d' % i} for i in range(3)],
+            0.0)
+        paths = [str(path) for path in paths]
+        self.assertEqual(self.access_points(), paths)
+        self.wait_for(lambda: len(self.added) == 3)
+        self.assertEqual(self.added, paths)
+
+    def test_rate(self):
+        """Signals go out at the rate asked for, after the call."""
+        start = time.monotonic()
+        paths = self.obj_nm.AddAccessPoints(
+            self.device_path,
+            [{'name': 'ap%d' % i, 'ssid': 'net'} for i in range(20)], 200.0)
+        self.assertEqual(len(self.access_points()), 20)
+        self.wait_for(lambda: len(self.added) == 20)
+        # 20 at 200 a second take a tenth of a second
+        self.assertGreater(time.monotonic() - start, 0.08)
+        self.assertEqual(self.added, [str(path) for path in paths])
+
+    def test_duplicate(self):
+        """None are added if one of them already exists."""
+        self.add_access_point('ap1', 'net')
+        self.assertRaises(
+            dbus.exceptions.DBusException, self.obj_nm.AddAccessPoints,
+            self.device_path,
+            [{'name': 'ap0', 'ssid': 'net'}, {'name': 'ap1', 'ssid': 'net'}],
+            0.0)
+        self.assertEqual(
+            self.access_points(),
+            ['/org/freedesktop/NetworkManager/AccessPoint/ap1'])
+
+    def test_missing_key(self):
+        """None are added if one of them lacks a name or SSID."""
+        for access_points in ([{'name': 'ap0', 'ssid': 'net'},
+                               {'name': 'ap1'}],
+                              [{'name': 'ap0', 'ssid': 'net'},
+                               {'ssid': 'net'}]):
+            with self.assertRaises(dbus.exceptions.DBusException) as error:
+                self.obj_nm.AddAccessPoints(self.device_path, access_points,
+                                            0.0)
+            self.assertEqual(error.exception.get_dbus_name(),
+                             NM_SERVICE + '.InvalidArgs')
+            self.assertEqual(self.access_points(), [])
+        # nor are they half there
+        self.obj_nm.AddAccessPoints(
+            self.device_path, [{'name': 'ap0', 'ssid': 'net'}], 0.0)
+        self.assertEqual(len(self.access_points()), 1)
+
+    def test_invalid_name(self):
+        """None are added if a name can't be in an object path."""
+        with self.assertRaises(dbus.exceptions.DBusException) as error:
+            self.obj_nm.AddAccessPoints(
+                self.device_path,
+                [{'name': 'ok1', 'ssid': 'net'},
+                 {'name': 'bad-name', 'ssid': 'net'}], 0.0)
+        self.assertEqual(error.exception.get_dbus_name(),
+                         NM_SERVICE + '.InvalidArgs')
+        self.assertEqual(self.access_points(), [])
+        self.obj_nm.AddAccessPoints(
+            self.device_path, [{'name': 'ok1', 'ssid': 'net'}], 0.0)
+        self.assertEqual(len(self.access_points()), 1)
+
+    def test_other_device(self):
+        """None are added if another device has one of them."""
+        other = self.obj_nm.AddWiFiDevice('test1', 'wlan1', 100)
+        self.obj_nm.AddAccessPoints(
+            other, [{'name': 'ap1', 'ssid': 'net'}], 0.0)
+        with self.assertRaises(dbus.exceptions.DBusException) as error:
+            self.obj_nm.AddAccessPoints(
+                self.device_path,
+                [{'name': 'ap0', 'ssid': 'net'},
+                 {'name': 'ap1', 'ssid': 'net'}], 0.0)
+        self.assertEqual(error.exception.get_dbus_name(),
+                         NM_SERVICE + '.AlreadyExists')
+        self.assertEqual(self.access_points(), [])
+        self.obj_nm.AddAccessPoints(
+            self.device_path, [{'name': 'ap0', 'ssid': 'net'}], 0.0)
+        self.assertEqual(len(self.access_points()), 1)
+
+    def test_out_of_range(self):
+        """Those added before one that fails are taken back."""
+        self.assertRaises(
+            dbus.exceptions.DBusException, self.obj_nm.AddAccessPoints,
+            self.device_path,
+            [dbus.Dictionary(ap, signature='sv') for ap in (
+                {'name': 'ap0', 'ssid': 'net'},
+                {'name': 'ap1', 'ssid': 'net', 'strength': 300})], 0.0)
+        self.assertEqual(self.access_points(), [])
+        self.obj_nm.AddAccessPoints(
+            self.device_path, [{'name': 'ap0', 'ssid': 'net'}], 0.0)
+        self.assertEqual(len(self.access_points()), 1)
+
+
+class AccessPointIndexTestCase(NetworkManagerMockTestCase):
+
+    def connect(self, name, ssid):
+        return self.obj_nm.AddWiFiConnection(
+            self.device_path, name, ssid, '',
+            dbus.Dictionary(signature='sa{sv}'))
+
+    def test_remove(self):
+        """Removed access points are gone by path and by SSID."""
+        first = self.add_access_point('ap0', 'net')
+        second = self.add_access_point('ap1', 'net')
+        other = self.add_access_point('ap2', 'other')
+        self.obj_nm.RemoveAccessPoint(self.device_path, first)
+        # the last takes the place of the one removed
+        self.assertEqual(self.access_points(), [other, second])
+        # the SSID is still around, on the other access point
+        self.connect('con0', 'net')
+        self.obj_nm.RemoveAccessPoint(self.device_path, second)
+        self.assertEqual(self.access_points(), [other])
+        with self.assertRaises(dbus.exceptions.DBusException) as error:
+            self.connect('con1', 'net')
+        self.assertEqual(error.exception.get_dbus_name(),
+                         NM_SERVICE + '.DoesNotExist')
+
+    def test_add_again(self):
+        """A removed access point can be added again, and goes last."""
+        first = self.add_access_point('ap0', 'net')
+        second = self.add_access_point('ap1', 'net')
+        self.obj_nm.RemoveAccessPoint(self.device_path, first)
+        self.assertEqual(self.add_access_point('ap0', 'net'), first)
+        self.assertEqual(self.access_points(), [second, first])
+
+    def test_add_existing(self):
+        path = self.add_access_point('ap0', 'net')
+        self.assertRaises(dbus.exceptions.DBusException,
+                          self.add_access_point, 'ap0', 'net')
+        self.assertEqual(self.access_points(), [path])
+
+    def test_remove_moved(self):
+        """An access point that took another's place can be removed."""
+        paths = [self.add_access_point('ap%d' % i, 'net') for i in range(4)]
+        self.obj_nm.RemoveAccessPoint(self.device_path, paths[1])
+        self.obj_nm.RemoveAccessPoint(self.device_path, paths[3])
+        self.assertEqual(self.access_points(), [paths[0], paths[2]])
+        self.obj_nm.RemoveAccessPoint(self.device_path, paths[0])
+        self.assertEqual(self.access_points(), [paths[2]])
+
+    def test_many(self):
+        """Thousands of access points come and go, announced together."""
+        changes = []
+        match = self.dbus_con.add_signal_receiver(
+            lambda iface, changed, invalidated: changes.append(
+                [str(path) for path in changed.get('AccessPoints', ())]),
+            'PropertiesChanged', dbus.PROPERTIES_IFACE,
+            path=self.device_path)
+        self.addCleanup(match.remove)
+        paths = self.obj_nm.AddAccessPoints(
+            self.device_path,
+            [{'name': 'ap%d' % i, 'ssid': 'net'} for i in range(2000)], 0.0)
+        for path in paths[:1000]:
+            self.obj_nm.RemoveAccessPoint(self.device_path, path)
+        left = sorted(str(path) for path in paths[1000:])
+        self.assertEqual(sorted(self.access_points()), left)
+        self.wait_for(lambda: changes and sorted(changes[-1]) == left)
+        # far fewer than one per change
+        self.assertLess(len(changes), 100)
+
+
+class ChurnTestCase(NetworkManagerMockTestCase):
+
+    def churn(self, seed=1, rate=200.0, **weights):
+        self.obj_nm.StartChurn(seed, rate,
+                               dbus.Dictionary(weights, signature='sd'))
+        self.addCleanup(self.obj_nm.StopChurn)
+
+    def settle(self, seconds):
+        """Runs the main loop for seconds."""
+        context = GLib.MainContext.default()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            context.iteration(False) or time.sleep(0.01)
+
+    def test_add_and_stop(self):
+        """Churn adds access points until it's stopped."""
+        self.churn(strength=0, add=1, remove=0, flip=0)
+        self.wait_for(lambda: len(self.access_points()) >= 10)
+        self.obj_nm.StopChurn()
+        count = len(self.access_points())
+        self.settle(0.1)
+        self.assertEqual(len(self.access_points()), count)
+        self.assertEqual(self.added[:count], self.access_points())
+
+    def test_rate(self):
+        """Churn keeps to rates GLib can't time exactly."""
+        start = time.monotonic()
+        self.churn(rate=150.0, strength=0, add=1, remove=0, flip=0)
+        self.settle(0.5)
+        self.obj_nm.StopChurn()
+        elapsed = time.monotonic() - start
+        count = len(self.access_points())
+        # not the 100 a second whole events per 10ms tick would make it
+        self.assertLessEqual(count, 150 * elapsed)
+        self.assertGreater(count, 150 * (elapsed - 0.1))
+
+    def test_in_use_stays(self):
+        """The access point in use is never removed."""
+        in_use = self.add_access_point('ap0', 'net')
+        for i in range(1, 10):
+            self.add_access_point('ap%d' % i, 'net%d' % i)
+        connection = self.obj_nm.AddWiFiConnection(
+            self.device_path, 'con0', 'net', '',
+            dbus.Dictionary(signature='sa{sv}'))
+        self.obj_nm.AddActiveConnection(
+            [self.device_path], connection, in_use, 'active0', 2)
+        self.churn(strength=0, add=0, remove=1, flip=0)
+        self.wait_for(lambda: self.access_points() == [in_use])
+        self.settle(0.1)
+        self.assertEqual(self.access_points(), [in_use])
+
+    def test_strength(self):
+        """Strength changes are announced."""
+        path = self.add_access_point('ap0', 'net')
+        changes = []
+        match = self.dbus_con.add_signal_receiver(
+            changes.append, 'PropertiesChanged',
+            'org.freedesktop.NetworkManager.AccessPoint', path=path)
+        self.addCleanup(match.remove)
+        self.churn(strength=1, add=0, remove=0, flip=0)
+        self.wait_for(lambda: len(changes) >= 5)
+        self.assertEqual(sorted(changes[0]), ['LastSeen', 'Strength'])
+        self.assertEqual(self.access_points(), [path])
+
+    def active_connection(self):
+        return self.device.Get('org.freedesktop.NetworkManager.Device',
+                               'ActiveConnection',
+                               dbus_interface=dbus.PROPERTIES_IFACE)
+
+    def test_flip(self):
+        """Flips activate connections on the access point with their SSID,
+        and deactivate them again."""
+        in_sight = self.add_access_point('ap0', 'net')
+        self.obj_nm.AddWiFiConnection(self.device_path, 'con0', 'net', '',
+                                      dbus.Dictionary(signature='sa{sv}'))
+        # one flip a tick, so that they don't undo each other in between
+        self.churn(rate=10.0, strength=0, add=0, remove=0, flip=1)
+        self.wait_for(lambda: self.active_connection() != '/')
+        active = self.dbus_con.get_object(NM_SERVICE,
+                                          self.active_connection())
+        self.assertEqual(
+            active.Get('org.freedesktop.NetworkManager.Connection.Active',
+                       'SpecificObject',
+                       dbus_interface=dbus.PROPERTIES_IFACE),
+            in_sight)
+        self.wait_for(lambda: self.active_connection() == '/')
+
+    def test_flip_out_of_sight(self):
+        """Connections with no access point in sight aren't activated."""
+        gone = self.add_access_point('ap0', 'net')
+        self.add_access_point('ap1', 'other')
+        self.obj_nm.AddWiFiConnection(self.device_path, 'con0', 'net', '',
+                                      dbus.Dictionary(signature='sa{sv}'))
+        self.obj_nm.RemoveAccessPoint(self.device_path, gone)
+        states = []
+        match = self.dbus_con.add_signal_receiver(
+            lambda new, old, reason: states.append(new), 'StateChanged',
+            'org.freedesktop.NetworkManager.Device', path=self.device_path)
+        self.addCleanup(match.remove)
+        self.churn(strength=0, add=0, remove=0, flip=1)
+        self.settle(0.2)
+        self.assertEqual(states, [])
+        self.assertEqual(self.active_connection(), '/')
+
+    def test_reset_stops(self):
+        """Resetting the mock stops any churn going on."""
+        self.churn(strength=0, add=1, remove=0, flip=0)
+        self.wait_for(lambda: len(self.access_points()) >= 1)
+        self.obj_nm.Reset()
+        self.device_path = self.obj_nm.AddWiFiDevice('test0', 'wlan0', 100)
+        self.settle(0.1)
+        self.assertEqual(self.access_points(), [])
+
+    def test_invalid(self):
+        for rate, weights in ((0.0, {}), (10.0, {'bogus': 1.0}),
+                              (10.0, dict.fromkeys(
+                                  ('strength', 'add', 'remove', 'flip'),
+                                  0.0))):
+            with self.assertRaises(dbus.exceptions.DBusException) as error:
+                self.churn(rate=rate, **weights)
+            self.assertEqual(error.exception.get_dbus_name(),
+                             NM_SERVICE + '.InvalidArgs')
+
+
+class DeviceRegistryTestCase(NetworkManagerMockTestCase):
+
+    def devices(self):
+        """The devices, as the property and the method list them."""
+        listed = self.obj_nm.GetDevices()
+        self.assertEqual(
+            self.obj_nm.Get(NM_SERVICE, 'Devices',
+                            dbus_interface=dbus.PROPERTIES_IFACE),
+            listed)
+        return [str(path) for path in listed]
+
+    def test_order(self):
+        """Devices are listed in the order they were added, access points
+        and connections aside."""
+        self.add_access_point('ap0', 'net')
+        ethernet = self.obj_nm.AddEthernetDevice('eth0', 'eth0', 100)
+        wifi = self.obj_nm.AddWiFiDevice('test1', 'wlan1', 100)
+        self.assertEqual(self.devices(), [self.device_path, ethernet, wifi])
+
+    def test_reset(self):
+        """Resetting the mock forgets its devices."""
+        self.obj_nm.Reset()
+        self.assertEqual(self.devices(), [])
+
+    def test_deactivate(self):
+        """Deactivating a connection finds its device in the registry."""
+        ap = self.add_access_point('ap0', 'net')
+        connection = self.obj_nm.AddWiFiConnection(
+            self.device_path, 'con0', 'net', '',
+            dbus.Dictionary(signature='sa{sv}'))
+        active = self.obj_nm.AddActiveConnection(
+            [self.device_path], connection, ap, 'active0', 2)
+        self.obj_nm.DeactivateConnection(active, dbus_interface=NM_SERVICE)
+        self.assertEqual(
+            self.device.Get('org.freedesktop.NetworkManager.Device',
+                            'ActiveConnection',
+                            dbus_interface=dbus.PROPERTIES_IFACE),
+            '/')
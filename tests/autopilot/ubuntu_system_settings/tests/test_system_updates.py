@@ -24,8 +24,6 @@ class SystemUpdatesTestCases(SystemUpdatesBaseTestCase):
         # Set environment variables
         self.useFixture(
             EnvironmentVariable("IGNORE_CREDENTIALS", "True"))
-        self.useFixture(
-            EnvironmentVariable("URL_APPS", "http://0.0.0.0:9009/metadata"))
         super(SystemUpdatesTestCases, self).setUp()
 
     def test_check_for_updates_area(self):
@@ -0,0 +1,53 @@
+'''Postal D-BUS stand-in for push helper benchmarks
+
+Keeps the persistent notifications posted to it, so ListPersistent and
+ClearPersistent behave. Every call takes call_delay seconds.
+'''
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.  See http://www.gnu.org/copyleft/lgpl.html for the full text
+# of the license.
+import json
+import time
+
+__copyright__ = '(c) 2016 Canonical Ltd.'
+__license__ = 'LGPL 3+'
+
+BUS_NAME = 'com.ubuntu.Postal'
+MAIN_IFACE = 'com.ubuntu.Postal'
+MAIN_OBJ = '/com/ubuntu/Postal/_'
+SYSTEM_BUS = False
+
+
+def post(self, app_id, message):
+    time.sleep(self.call_delay)
+    self.persistent.setdefault(app_id, set()).add(json.loads(message))
+
+
+def list_persistent(self, app_id):
+    time.sleep(self.call_delay)
+    return sorted(self.persistent.get(app_id, ()))
+
+
+def clear_persistent(self, app_id, tag):
+    time.sleep(self.call_delay)
+    self.persistent.get(app_id, set()).discard(tag)
+
+
+def load(mock, parameters):
+    mock.call_delay = parameters.get('call_delay', 0.0)
+    mock.persistent = {}
+
+    mock.post = post
+    mock.list_persistent = list_persistent
+    mock.clear_persistent = clear_persistent
+
+    mock.AddMethods(MAIN_IFACE, [
+        ('Post', 'ss', '', 'self.post(self, args[0], args[1])'),
+        ('ListPersistent', 's', 'as',
+         'ret = self.list_persistent(self, args[0])'),
+        ('ClearPersistent', 'ss', '',
+         'self.clear_persistent(self, args[0], args[1])'),
+    ])
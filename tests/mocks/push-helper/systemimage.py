@@ -0,0 +1,67 @@
+'''system image D-BUS stand-in for push helper benchmarks
+
+Unlike the autopilot template, CheckForUpdate actually answers: after
+check_delay seconds it emits UpdateAvailableStatus and, if the update is
+downloading, UpdateDownloaded (or UpdateFailed, if fail is set) another
+download_delay seconds later.
+'''
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.  See http://www.gnu.org/copyleft/lgpl.html for the full text
+# of the license.
+import dbus
+
+from gi.repository import GLib
+
+__copyright__ = '(c) 2016 Canonical Ltd.'
+__license__ = 'LGPL 3+'
+
+BUS_NAME = 'com.canonical.SystemImage'
+MAIN_IFACE = 'com.canonical.SystemImage'
+MAIN_OBJ = '/Service'
+SYSTEM_BUS = True
+
+
+def emit_available(self):
+    self.EmitSignal(MAIN_IFACE, 'UpdateAvailableStatus', 'bbsiss', [
+        self.si_props['available'], self.si_props['downloading'],
+        '42', dbus.Int32(4096), '', ''
+    ])
+    if self.si_props['available'] and self.si_props['downloading']:
+        GLib.timeout_add(int(self.si_props['download_delay'] * 1000),
+                         self.emit_downloaded, self)
+    return False
+
+
+def emit_downloaded(self):
+    if self.si_props['fail']:
+        self.EmitSignal(MAIN_IFACE, 'UpdateFailed', 'is',
+                        [dbus.Int32(1), 'failed'])
+    else:
+        self.EmitSignal(MAIN_IFACE, 'UpdateDownloaded', '', [])
+    return False
+
+
+def checkforupdate(self):
+    GLib.timeout_add(int(self.si_props['check_delay'] * 1000),
+                     self.emit_available, self)
+
+
+def load(mock, parameters):
+    mock.si_props = {
+        'available': parameters.get('available', True),
+        'downloading': parameters.get('downloading', False),
+        'fail': parameters.get('fail', False),
+        'check_delay': parameters.get('check_delay', 0.1),
+        'download_delay': parameters.get('download_delay', 0.5),
+    }
+
+    mock.emit_available = emit_available
+    mock.emit_downloaded = emit_downloaded
+    mock.checkforupdate = checkforupdate
+
+    mock.AddMethods(MAIN_IFACE, [
+        ('CheckForUpdate', '', '', 'self.checkforupdate(self)'),
+    ])
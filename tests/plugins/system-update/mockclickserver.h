@@ -1,8 +1,11 @@
 #ifndef MOCK_CLICKSERVER_TESTCASE_H
 #define MOCK_CLICKSERVER_TESTCASE_H
 
+#include <QElapsedTimer>
 #include <QTest>
 #include <QProcess>
+#include <QRegularExpression>
+#include <QUrl>
 #include <QDebug>
 
 class MockClickServerTestCase
@@ -11,36 +14,39 @@ protected:
     void startMockClickServer(const QStringList &args = QStringList())
     {
         QStringList params;
-        params << "mockclickserver.py";
+        // The mock click server package is found on PYTHONPATH; what it
+        // serves by default is in the scenario.
+        params << "-m" << "mockclickserver";
+        params << "--scenario" << "clickserver.json";
         params << args;
-        params << "--port" << QString::number(m_port);
+        // Any free port, so that test runs don't get in each other's way.
+        params << "--port" << "0";
         m_mockclickserver.start("python3", params);
         QVERIFY(m_mockclickserver.waitForStarted());
 
-        QTRY_COMPARE(m_mockclickserver.state(), QProcess::Running);
-
-        /* QTRY_VERIFY can't be used for reading std out for some
-        reason, so we do a manual timeout on failure to read
-        “Started” from the server’s output. */
-        for (int i = 0; i < 5; i++) {
-            QString out(m_mockclickserver.readAllStandardOutput());
-            if (out.contains("Started")) {
+        /* The server says it started once it is serving, which also tells
+        the port it got; until then, wait for its output rather than for
+        a fixed time. */
+        QRegularExpression started("Started .* on http://[^:]+:(\\d+)");
+        QString out;
+        QElapsedTimer timer;
+        timer.start();
+        while (timer.elapsed() < 10000 &&
+               m_mockclickserver.waitForReadyRead(10000 - timer.elapsed())) {
+            out += QString(m_mockclickserver.readAllStandardOutput());
+            auto match = started.match(out);
+            if (match.hasMatch()) {
+                m_port = match.captured(1).toUInt();
+                /* Where the click client looks for the server, unless told
+                otherwise. */
+                qputenv("URL_APPS", mockClickServerUrl("/metadata")
+                                        .toString().toUtf8());
                 return;
             }
-            QTest::qWait(1000);
         }
 
-        qWarning() << "Failed to start server"
-                   << m_mockclickserver.readAllStandardError()
-                   << "\n\nRetrying on a different port...";
-
-        if (m_retries < 10) {
-            m_port++;
-            m_retries++;
-            startMockClickServer(args);
-        } else {
-            QFAIL("Could not start server.");
-        }
+        QFAIL(qPrintable("Could not start server: " +
+                         m_mockclickserver.readAllStandardError()));
     }
 
     void stopMockClickServer()
@@ -49,9 +55,13 @@ protected:
         QTRY_COMPARE(m_mockclickserver.state(), QProcess::NotRunning);
     }
 
+    QUrl mockClickServerUrl(const QString &path) const
+    {
+        return QUrl(QString("http://127.0.0.1:%1%2").arg(m_port).arg(path));
+    }
+
     QProcess m_mockclickserver;
-    uint m_port = 9009;
-    uint m_retries = 0;
+    uint m_port = 0;
 };
 
 #endif // MOCK_CLICKSERVER_TESTCASE_H
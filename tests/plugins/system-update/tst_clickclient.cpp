@@ -79,7 +79,7 @@ private slots:
         QSignalSpy metadataRequestSucceededSpy(
             m_instance, SIGNAL(metadataRequestSucceeded(const QJsonArray&))
         );
-        QUrl query("http://localhost:9009/metadata");
+        QUrl query(mockClickServerUrl("/metadata"));
         m_instance->requestMetadata(query, names);
         QVERIFY(metadataRequestSucceededSpy.wait());
         QCOMPARE(metadataRequestSucceededSpy.count(), 1);
@@ -87,7 +87,7 @@ private slots:
     void testMetadataRequestAuthFailure()
     {
         QSignalSpy credentialErrorSpy(m_instance, SIGNAL(credentialError()));
-        QUrl query("http://localhost:9009/403");
+        QUrl query(mockClickServerUrl("/403"));
         m_instance->requestMetadata(query, QList<QString>());
         QVERIFY(credentialErrorSpy.wait());
         QCOMPARE(credentialErrorSpy.count(), 1);
@@ -95,7 +95,7 @@ private slots:
     void testMetadataRequestNotFoundFailure()
     {
         QSignalSpy serverErrorSpy(m_instance, SIGNAL(serverError()));
-        QUrl query("http://localhost:9009/404");
+        QUrl query(mockClickServerUrl("/404"));
         m_instance->requestMetadata(query, QList<QString>());
         QVERIFY(serverErrorSpy.wait());
         QCOMPARE(serverErrorSpy.count(), 1);
@@ -112,7 +112,7 @@ private slots:
         QSignalSpy bSuccessSpy(
             b, SIGNAL(metadataRequestSucceeded(const QJsonArray&))
         );
-        QUrl query("http://localhost:9009/metadata");
+        QUrl query(mockClickServerUrl("/metadata"));
         a->requestMetadata(query, QList<QString>());
         QVERIFY(aSuccessSpy.wait());
         QCOMPARE(aSuccessSpy.count(), 1);